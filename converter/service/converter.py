@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
 
+import asyncio
+import base64
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import email.utils
+import functools
+import gzip
+import hashlib
+import html
+import http.client
+import io
 import json
 import logging
+import multiprocessing
 import os
 import re
+import ssl
+import threading
+import time
+import zlib
 from enum import Enum
 from http import HTTPStatus
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import (BaseHTTPRequestHandler, DEFAULT_ERROR_CONTENT_TYPE,
+                         DEFAULT_ERROR_MESSAGE, HTTPServer)
 from socketserver import ThreadingMixIn
 from urllib.error import HTTPError, URLError
-from urllib.parse import parse_qsl, urlparse
-from urllib.request import Request, urlopen
+from urllib.parse import parse_qsl, unquote, urljoin, urlparse, urlsplit
+from urllib.request import Request, getproxies, proxy_bypass
 
 import gen_universe
 
@@ -19,25 +38,78 @@ HOST_NAME = ''
 # Gets the port number from $PORT0 environment variable
 PORT_NUMBER = int(os.environ['PORT_UNIVERSECONVERTER'])
 MAX_REPO_SIZE = int(os.environ.get('MAX_REPO_SIZE', '20'))
+# Number of per-package validation results kept in memory
+VALIDATION_CACHE_SIZE = int(os.environ.get('VALIDATION_CACHE_SIZE', '10000'))
+# Number of rendered responses kept in memory
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '32'))
+# Seconds a rendered response is served before revalidating with the upstream
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '60'))
+# `threaded` serves each request on its own thread, `async` serves all
+# requests from an asyncio event loop
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threaded')
+# Number of /transform requests handled at once in `async` mode
+MAX_CONCURRENT_TRANSFORMS = int(
+    os.environ.get('MAX_CONCURRENT_TRANSFORMS', '1024'))
+# Number of processes that render responses in `async` mode
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+# Seconds to wait for a connection to an upstream
+UPSTREAM_CONNECT_TIMEOUT = float(
+    os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '10'))
+# Seconds to wait for every read from an upstream
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', '60'))
+# Number of connections open to an upstream host at once. Idle connections
+# are kept alive and reused.
+MAX_CONNECTIONS_PER_HOST = int(
+    os.environ.get('MAX_CONNECTIONS_PER_HOST', '8'))
 
 # Constants
-MAX_TIMEOUT = 60
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Upper bounds of the latency histograms in seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+# Upper bounds of the response size histogram in bytes
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
 MAX_BYTES = MAX_REPO_SIZE * 1024 * 1024
+MAX_REDIRECTIONS = 10
+MAX_ERROR_BODY_BYTES = 64 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+GZIP_LEVEL = 6
+BODYLESS_CODES = {HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED}
+REDIRECT_CODES = {
+    HTTPStatus.MOVED_PERMANENTLY,
+    HTTPStatus.FOUND,
+    HTTPStatus.SEE_OTHER,
+    HTTPStatus.TEMPORARY_REDIRECT,
+    HTTPStatus.PERMANENT_REDIRECT
+}
 
 header_user_agent = 'User-Agent'
 header_accept = 'Accept'
 header_content_type = 'Content-Type'
 header_content_length = 'Content-Length'
+header_content_encoding = 'Content-Encoding'
+header_accept_encoding = 'Accept-Encoding'
+header_transfer_encoding = 'Transfer-Encoding'
+header_vary = 'Vary'
+header_connection = 'Connection'
+encoding_gzip = 'gzip'
+header_etag = 'ETag'
+header_last_modified = 'Last-Modified'
+header_if_none_match = 'If-None-Match'
+header_if_modified_since = 'If-Modified-Since'
+header_location = 'Location'
 param_charset = 'charset'
 default_charset = 'utf-8'
 
 json_key_packages = 'packages'
 param_url = 'url'
 transform_url_path = '/transform'
+metrics_url_path = '/metrics'
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
-    level=os.environ.get('LOGLEVEL', 'DEBUG'),
+    level=os.environ.get('LOGLEVEL', 'INFO'),
     format="[%(asctime)s|%(threadName)s-%(funcName)s(%(lineno)d)|%(levelname)s]: %(message)s",
 )
 
@@ -45,6 +117,457 @@ logging.basicConfig(
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle each request in a separate thread"""
 
+    # Bursts of identical requests are coalesced by `transforms`, but only
+    # once they are accepted. The default backlog of 5 drops most of them.
+    request_queue_size = 128
+
+
+class LRUCache:
+    """A thread safe mapping that keeps at most `max_size` entries, evicting
+    the least recently used entry first."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value for `key` or None if it is not cached"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SingleFlight:
+    """Runs a function once for concurrent calls with the same key. Callers
+    that arrive while the call is in flight wait for it and share its result
+    or exception."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = SingleFlight._Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Async counterpart of `SingleFlight`. Must only be used from one event
+    loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn, *args):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # Shielded so that a disconnecting client does not cancel the call
+        # for everybody else waiting on it
+        return await asyncio.shield(task)
+
+
+class ConnectionPool:
+    """Keep-alive connections to upstream hosts shared by all threads. At
+    most `max_per_host` connections to an origin are open at once, callers
+    wait for a connection to be released beyond that."""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._origins = {}
+        self._lock = threading.Lock()
+
+    def request(self, origin, target, headers):
+        """Sends a GET request on a pooled connection. The connection must be
+        handed back with `release`, even if the response is an error.
+
+        :param origin: (scheme, host, port) of the upstream
+        :type origin: (str, str, int)
+        :param target: path and query of the request
+        :type target: str
+        :param headers: request headers
+        :type headers: dict
+        :return the connection and its response
+        :rtype (http.client.HTTPConnection, http.client.HTTPResponse)
+        """
+        semaphore, idle = self._origin(origin)
+        semaphore.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn = idle.pop() if idle else None
+                is_reused = conn is not None
+                if not is_reused:
+                    conn = _connect(origin)
+                try:
+                    conn.request('GET', target, headers=headers)
+                    return conn, conn.getresponse()
+                except (http.client.RemoteDisconnected,
+                        ConnectionResetError,
+                        BrokenPipeError) as e:
+                    conn.close()
+                    # The upstream closed an idle connection, retry on a
+                    # fresh one
+                    if not is_reused:
+                        raise URLError(e)
+                except OSError as e:
+                    conn.close()
+                    raise URLError(e)
+        except BaseException:
+            semaphore.release()
+            raise
+
+    def release(self, origin, conn, is_reusable):
+        semaphore, idle = self._origin(origin)
+        if is_reusable:
+            with self._lock:
+                idle.append(conn)
+        else:
+            conn.close()
+        semaphore.release()
+
+    def _origin(self, origin):
+        with self._lock:
+            if origin not in self._origins:
+                self._origins[origin] = (
+                    threading.BoundedSemaphore(self.max_per_host),
+                    []
+                )
+            return self._origins[origin]
+
+
+class AsyncConnectionPool:
+    """Async counterpart of `ConnectionPool` holding asyncio streams. Must only
+    be used from one event loop."""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._origins = {}
+
+    async def request(self, origin, request):
+        """Sends a request on a pooled connection and reads the response
+        head. The connection must be handed back with `release`.
+
+        :param origin: (scheme, host, port) of the upstream
+        :type origin: (str, str, int)
+        :param request: the serialized request
+        :type request: bytes
+        :return the connection streams and the response status line and
+                headers
+        :rtype (asyncio.StreamReader, asyncio.StreamWriter, str, int, str,
+                http.client.HTTPMessage)
+        """
+        semaphore, idle = self._origin(origin)
+        await semaphore.acquire()
+        try:
+            while True:
+                reader, writer = idle.pop() if idle else (None, None)
+                is_reused = reader is not None
+                if is_reused and reader.at_eof():
+                    writer.close()
+                    continue
+                if not is_reused:
+                    reader, writer = await _connect_async(origin)
+                try:
+                    writer.write(request)
+                    head = await _with_read_timeout(
+                        reader.readuntil(b'\r\n\r\n')
+                    )
+                except asyncio.IncompleteReadError as e:
+                    writer.close()
+                    # The upstream closed an idle connection, retry on a
+                    # fresh one
+                    if not is_reused or e.partial:
+                        raise URLError(e)
+                    continue
+                except (asyncio.LimitOverrunError, OSError) as e:
+                    writer.close()
+                    raise e if isinstance(e, URLError) else URLError(e)
+                return (reader, writer) + _parse_response_head(head)
+        except BaseException:
+            semaphore.release()
+            raise
+
+    def release(self, origin, reader, writer, is_reusable):
+        semaphore, idle = self._origin(origin)
+        if is_reusable:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+        semaphore.release()
+
+    def _origin(self, origin):
+        # Created lazily so that the semaphore belongs to the running loop
+        if origin not in self._origins:
+            self._origins[origin] = (
+                asyncio.Semaphore(self.max_per_host),
+                []
+            )
+        return self._origins[origin]
+
+
+class Metric:
+    """A metric family exposed in the Prometheus text format. Samples are
+    kept per combination of label values."""
+
+    def __init__(self, name, documentation, metric_type, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        """Returns the metric family in the Prometheus text format
+
+        :rtype str
+        """
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.metric_type)
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            labels = list(zip(self.label_names, label_values))
+            lines.extend(
+                '{}{} {}'.format(name, _format_labels(labels), repr(sample))
+                for name, labels, sample in self._samples(labels, value)
+            )
+        return '\n'.join(lines)
+
+    def _samples(self, labels, value):
+        yield self.name, labels, value
+
+    def _label_values(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class CounterMetric(Metric):
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, 'counter', label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class GaugeMetric(Metric):
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, 'gauge', label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """Counts the duration of the `with` block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class HistogramMetric(Metric):
+    def __init__(self, name, documentation, buckets, label_names=()):
+        super().__init__(name, documentation, 'histogram', label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * len(self.buckets), [0.0], [0])
+            bucket_counts, total, count = self._values[key]
+            if index < len(bucket_counts):
+                bucket_counts[index] += 1
+            total[0] += value
+            count[0] += 1
+
+    def _samples(self, labels, value):
+        bucket_counts, total, count = value
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            yield (
+                self.name + '_bucket',
+                labels + [('le', repr(float(upper_bound)))],
+                cumulative
+            )
+        yield self.name + '_bucket', labels + [('le', '+Inf')], count[0]
+        yield self.name + '_sum', labels, total[0]
+        yield self.name + '_count', labels, count[0]
+
+
+class LimitedBody:
+    """Accumulates an upstream response body as it is read, decoding its
+    Content-Encoding on the fly. Raises a ValueError as soon as the decoded
+    body grows larger than MAX_BYTES."""
+
+    def __init__(self, headers):
+        content_length = headers.get(header_content_length)
+        if content_length is not None and int(content_length) > MAX_BYTES:
+            raise ValueError(ErrorResponse.MAX_SIZE.to_msg())
+
+        encoding = (headers.get(header_content_encoding) or 'identity')\
+            .strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+        elif encoding == 'identity':
+            self._decompressor = None
+        else:
+            raise ValueError(ErrorResponse.UNSUPPORTED_ENCODING.to_msg(encoding))
+        self._body = bytearray()
+
+    def feed(self, chunk):
+        if self._decompressor is not None:
+            # Never inflate more than one byte past the limit
+            chunk = self._decompressor.decompress(
+                chunk,
+                MAX_BYTES + 1 - len(self._body)
+            )
+        self._append(chunk)
+
+    def finish(self):
+        """Returns the decoded body
+
+        :rtype bytearray
+        """
+        if self._decompressor is not None:
+            self._append(self._decompressor.flush())
+        return self._body
+
+    def _append(self, chunk):
+        self._body += chunk
+        if len(self._body) > MAX_BYTES:
+            raise ValueError(ErrorResponse.MAX_SIZE.to_msg())
+
+
+# A rendered response, its gzip encoding once a client asked for it and the
+# upstream validators needed to revalidate it
+CachedResponse = collections.namedtuple(
+    'CachedResponse',
+    ['json_response', 'gzip_response', 'etag', 'last_modified', 'expires_at']
+)
+
+# Validation errors by (package digest, repo version)
+validation_cache = LRUCache(VALIDATION_CACHE_SIZE)
+# Rendered responses by (upstream url, dcos version, repo version)
+response_cache = LRUCache(RESPONSE_CACHE_SIZE)
+# Keep-alive connections to upstream hosts
+connection_pool = ConnectionPool(MAX_CONNECTIONS_PER_HOST)
+async_connection_pool = AsyncConnectionPool(MAX_CONNECTIONS_PER_HOST)
+# Metrics served on /metrics
+version_labels = ('dcos_version', 'repo_version')
+transform_requests = CounterMetric(
+    'converter_transform_requests_total',
+    'Number of /transform requests by response status',
+    ['status']
+)
+transforms_in_flight = GaugeMetric(
+    'converter_transform_requests_in_flight',
+    'Number of /transform requests being handled'
+)
+response_cache_requests = CounterMetric(
+    'converter_response_cache_requests_total',
+    'Number of rendered response cache lookups by result',
+    ['result']
+)
+validation_cache_requests = CounterMetric(
+    'converter_validation_cache_requests_total',
+    'Number of package validation cache lookups by result',
+    ['result']
+)
+upstream_fetch_seconds = HistogramMetric(
+    'converter_upstream_fetch_seconds',
+    'Time to fetch a repo from its upstream',
+    LATENCY_BUCKETS,
+    version_labels
+)
+render_stage_metrics = collections.OrderedDict(
+    (stage, HistogramMetric(
+        'converter_{}_seconds'.format(stage),
+        documentation,
+        LATENCY_BUCKETS,
+        version_labels
+    ))
+    for stage, documentation in [
+        ('parse', 'Time to parse the json of an upstream repo'),
+        ('filter', 'Time to filter and downgrade the packages of a repo'),
+        ('validation', 'Time to validate the packages of a repo'),
+        ('serialization', 'Time to serialize a rendered repo')
+    ]
+)
+response_size_bytes = HistogramMetric(
+    'converter_response_size_bytes',
+    'Size of successful /transform response bodies',
+    SIZE_BUCKETS,
+    version_labels + ('content_encoding',)
+)
+registered_metrics = [
+    transform_requests,
+    transforms_in_flight,
+    response_cache_requests,
+    validation_cache_requests,
+    upstream_fetch_seconds
+] + list(render_stage_metrics.values()) + [response_size_bytes]
+# In flight upstream fetches by (upstream url, dcos version, repo version)
+transforms = SingleFlight()
+async_transforms = AsyncSingleFlight()
+
 
 class Handler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
@@ -52,11 +575,14 @@ class Handler(BaseHTTPRequestHandler):
         logger.info("[%s] %s", self.address_string(), format % args)
 
     def do_GET(self):
-        logger.debug('\n{}\n{}'.format(self.requestline, self.headers).rstrip())
+        logger.debug('\n%s\n%s', self.requestline, _format_dict(self.headers))
         url_path = urlparse(self.path).path
         try:
             if url_path == transform_url_path:
-                self.handle_transform()
+                with transforms_in_flight.track():
+                    self.handle_transform()
+            elif url_path == metrics_url_path:
+                self.handle_metrics()
             else:
                 raise ValueError(ErrorResponse.INVALID_PATH.to_msg(url_path))
         except Exception as e:
@@ -71,64 +597,139 @@ class Handler(BaseHTTPRequestHandler):
                 http://<host>:<port>/transform?url=<url> with `User-Agent`
                 and `Accept` headers
         """
-        errors = _validate_request(self)
-        if errors:
-            self.send_error(HTTPStatus.BAD_REQUEST, explain=errors)
-            return
+        query, decoded_url, user_agent, accept = _parse_transform_request(
+            self.path,
+            self.headers
+        )
 
-        query = dict(parse_qsl(urlparse(self.path).query))
-        if param_url not in query:
-            self.send_error(
-                HTTPStatus.BAD_REQUEST,
-                explain=ErrorResponse.PARAM_NOT_PRESENT.to_msg(param_url)
+        try:
+            content_type, content_encoding, json_response = handle(
+                decoded_url,
+                user_agent,
+                accept,
+                self.headers.get(header_accept_encoding)
             )
+        except Exception as e:
+            status, explain = _error_response(e, query, user_agent, accept)
+            transform_requests.inc(status=status.value)
+            self.send_error(status, explain=explain)
             return
 
-        user_agent = self.headers.get(header_user_agent)
-        accept = self.headers.get(header_accept)
-        decoded_url = query.get(param_url)
+        transform_requests.inc(status=HTTPStatus.OK.value)
+        self.send_response(HTTPStatus.OK)
+        for header, value in _response_headers(
+                content_type, content_encoding, json_response):
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(json_response)
+
+    def handle_metrics(self):
+        """Respond with the metrics of the converter in the Prometheus text
+        format
+        """
+        body = render_metrics()
+        self.send_response(HTTPStatus.OK)
+        self.send_header(header_content_type, METRICS_CONTENT_TYPE)
+        self.send_header(header_content_length, len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AsyncHandler:
+    """Serves the converter from an asyncio event loop. Upstream repos are
+    fetched without blocking the loop and responses are rendered in a pool of
+    worker processes. Every connection serves a single request, like
+    `Handler`.
+    """
+
+    def __init__(self, render_pool):
+        self.render_pool = render_pool
+        self.transforms = asyncio.Semaphore(MAX_CONCURRENT_TRANSFORMS)
 
+    async def __call__(self, reader, writer):
+        address = (writer.get_extra_info('peername') or ('-',))[0]
         try:
-            content_type, json_response = handle(decoded_url, user_agent, accept)
-        except ValueError as e:
-            self.send_error(HTTPStatus.BAD_REQUEST, explain=str(e))
-            return
-        except HTTPError as e:
-            logger.info(
-                'Upstream error :\nURL: [%s]\nReason: [%s %s]\nBody:\n[%s]',
-                decoded_url,
-                e.code,
-                e.reason,
-                e.read(),
-                exc_info=True
+            try:
+                request = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            request_line, _, header_block = request.partition(b'\r\n')
+            requestline = request_line.decode('iso-8859-1')
+            status, headers, body = await self.handle_request(
+                requestline,
+                http.client.parse_headers(io.BytesIO(header_block))
             )
-            self.send_error(HTTPStatus.BAD_GATEWAY, explain=str(e))
-            return
-        except URLError as e:
-            logger.info(
-                'Route error :\nURL: [%s]\nReason: [%s]',
-                decoded_url,
-                e.reason,
-                exc_info=True
+            writer.write(_format_response(status, headers, body))
+            await writer.drain()
+            logger.info('[%s] "%s" %s %s', address, requestline, status.value, len(body))
+        except ConnectionError:
+            logger.info('[%s] Connection closed by client', address)
+        finally:
+            writer.close()
+
+    async def handle_request(self, requestline, headers):
+        """Returns the status, headers and body of the response"""
+        logger.debug('\n%s\n%s', requestline, _format_dict(headers))
+        words = requestline.split()
+        if len(words) != 3:
+            return _error_page(
+                HTTPStatus.BAD_REQUEST,
+                'Bad request syntax ({!r})'.format(requestline)
             )
-            self.send_error(HTTPStatus.BAD_GATEWAY, explain=str(e))
-            return
+        method, path, _ = words
+        if method != 'GET':
+            return _error_page(
+                HTTPStatus.NOT_IMPLEMENTED,
+                'Unsupported method ({!r})'.format(method)
+            )
+
+        url_path = urlparse(path).path
+        try:
+            if url_path == transform_url_path:
+                with transforms_in_flight.track():
+                    return await self.handle_transform(path, headers)
+            elif url_path == metrics_url_path:
+                body = render_metrics()
+                return HTTPStatus.OK, [
+                    (header_content_type, METRICS_CONTENT_TYPE),
+                    (header_content_length, len(body))
+                ], body
+            else:
+                raise ValueError(ErrorResponse.INVALID_PATH.to_msg(url_path))
         except Exception as e:
-            logger.exception(
-                'Unhandled exception for [{}] UA [{}] Accept [{}]'.format(
-                    query,
-                    user_agent,
-                    accept
-                ),
-                e
+            return _error_page(
+                HTTPStatus.BAD_REQUEST,
+                e.message if hasattr(e, 'message') else str(e)
             )
-            raise e
 
-        self.send_response(HTTPStatus.OK)
-        self.send_header(header_content_type, content_type)
-        self.send_header(header_content_length, len(json_response))
-        self.end_headers()
-        self.wfile.write(json_response.encode())
+    async def handle_transform(self, path, headers):
+        """Async counterpart of `Handler.handle_transform`"""
+        query, decoded_url, user_agent, accept = _parse_transform_request(
+            path,
+            headers
+        )
+
+        async with self.transforms:
+            try:
+                content_type, content_encoding, json_response = \
+                    await handle_async(
+                        decoded_url,
+                        user_agent,
+                        accept,
+                        headers.get(header_accept_encoding),
+                        self.render_pool
+                    )
+            except Exception as e:
+                status, explain = _error_response(e, query, user_agent, accept)
+                transform_requests.inc(status=status.value)
+                return _error_page(status, explain)
+
+        transform_requests.inc(status=HTTPStatus.OK.value)
+        return HTTPStatus.OK, _response_headers(
+            content_type,
+            content_encoding,
+            json_response
+        ), json_response
 
 
 def run_server():
@@ -136,6 +737,10 @@ def run_server():
 
     :return: None
     """
+    if SERVER_MODE == 'async':
+        run_async_server()
+        return
+
     server_address = (HOST_NAME, PORT_NUMBER)
     httpd = ThreadedHTTPServer(server_address, Handler)
     logger.warning('Server Starts on port - %s', PORT_NUMBER)
@@ -146,7 +751,35 @@ def run_server():
         logger.warning('Server Stops on port - %s', PORT_NUMBER)
 
 
-def handle(decoded_url, user_agent, accept) -> (str, str):
+def run_async_server():
+    """Runs the converter on an asyncio event loop with `AsyncHandler`.
+
+    :return: None
+    """
+    async def serve(render_pool):
+        server = await asyncio.start_server(
+            AsyncHandler(render_pool),
+            HOST_NAME or None,
+            PORT_NUMBER,
+            backlog=MAX_CONCURRENT_TRANSFORMS
+        )
+        async with server:
+            await server.serve_forever()
+
+    logger.warning('Async server Starts on port - %s', PORT_NUMBER)
+    # Workers are started on demand. Forking them would leak the client
+    # sockets open at that moment into the workers and keep them open.
+    with concurrent.futures.ProcessPoolExecutor(
+            RENDER_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')) as render_pool:
+        try:
+            asyncio.run(serve(render_pool))
+        except KeyboardInterrupt:
+            logger.warning('Async server Stops on port - %s', PORT_NUMBER)
+
+
+def handle(decoded_url, user_agent, accept, accept_encoding=None) \
+        -> (str, str, bytes):
     """Returns the requested json data. May raise an error instead, if it fails.
 
     :param decoded_url: The url to be fetched from
@@ -154,50 +787,670 @@ def handle(decoded_url, user_agent, accept) -> (str, str):
     :param user_agent: User-Agent header value
     :type user_agent: str
     :param accept: Accept header value
+    :param accept_encoding: Accept-Encoding header value
+    :type accept_encoding: str | None
+    :return Content type, content encoding (None for identity) and the
+            requested json data
+    :rtype (str, str | None, bytes)
+    """
+    content_type, repo_version = _get_repo_version(accept)
+    dcos_version = _get_dcos_version(user_agent)
+    logger.debug('Version [%s] DC/OS [%s]', repo_version, dcos_version)
+
+    cache_key = (decoded_url, dcos_version, repo_version)
+    cached = response_cache.get(cache_key)
+    if _is_fresh(cached):
+        logger.debug('Serving cached response for [%s]', decoded_url)
+        response_cache_requests.inc(result='hit')
+        json_response = cached.json_response
+    else:
+        response_cache_requests.inc(result='miss')
+        # Concurrent requests for the same repo share one fetch and render
+        json_response = transforms.do(
+            cache_key,
+            _transform,
+            cache_key,
+            cached,
+            user_agent,
+            accept
+        )
+
+    if _accepts_gzip(accept_encoding):
+        content_encoding = encoding_gzip
+        json_response = _gzip_response(cache_key, json_response)
+    else:
+        content_encoding = None
+    _observe_response_size(cache_key, content_encoding, json_response)
+    return content_type, content_encoding, json_response
+
+
+def _transform(cache_key, cached, user_agent, accept):
+    """Fetches the upstream repo and renders it for the versions in
+    `cache_key`. Revalidates `cached` if present.
+
+    :param cache_key: (upstream url, dcos version, repo version)
+    :type cache_key: (str, str, str)
+    :param cached: the cached response for this request, if any
+    :type cached: CachedResponse | None
+    :param user_agent: User-Agent header value
+    :type user_agent: str
+    :param accept: Accept header value
+    :return Requested json data
+    :rtype bytes (a valid json object)
+    """
+    decoded_url, dcos_version, repo_version = cache_key
+    req = _upstream_request(decoded_url, user_agent, accept, cached)
+    started_at = time.perf_counter()
+    try:
+        status, reason, headers, resp_content = _fetch(req)
+    except HTTPError as e:
+        if not _is_not_modified(e, cached):
+            raise
+        _observe_fetch(cache_key, time.perf_counter() - started_at)
+        return _revalidate(cache_key, cached)
+    fetch_seconds = time.perf_counter() - started_at
+
+    _log_upstream_response(status, reason, headers)
+    # The connection went back to the pool before rendering
+    json_response, stats = render_response(
+        decoded_url,
+        resp_content,
+        headers.get_param(param_charset) or default_charset,
+        dcos_version,
+        repo_version
+    )
+    # Observed once rendering validated the requested repo version
+    _observe_fetch(cache_key, fetch_seconds)
+    _observe_render(cache_key, stats)
+    _cache_response(cache_key, json_response, headers)
+    return json_response
+
+
+def _fetch(req):
+    """Fetches `req` and reads the whole response body
+
+    :param req: the upstream request
+    :type req: urllib.request.Request
+    :return status, reason, headers and body of the response
+    :rtype (int, str, http.client.HTTPMessage, bytes)
+    """
+    with _urlopen(req) as res:
+        body = LimitedBody(res.headers)
+        for chunk in iter(lambda: res.read(READ_CHUNK_BYTES), b''):
+            body.feed(chunk)
+        return res.status, res.reason, res.headers, body.finish()
+
+
+@contextlib.contextmanager
+def _urlopen(req):
+    """Opens `req` on a pooled keep-alive connection. Like `urlopen` it
+    follows redirects and raises HTTPError for any other non 2xx response.
+    The connection is reused once the response was read completely.
+    Requests go through the proxy configured in the environment, if any.
+
+    :param req: the upstream request
+    :type req: urllib.request.Request
+    :return the response
+    :rtype http.client.HTTPResponse
+    """
+    url = req.full_url
+    headers = dict(req.header_items())
+    for _ in range(MAX_REDIRECTIONS + 1):
+        origin, target = _split_url(url)
+        request_headers = headers
+        proxy = _proxy(origin)
+        if proxy is not None and origin[0] == 'http':
+            # Plain http requests are forwarded by the proxy itself, https
+            # requests are tunneled by `_connect`
+            target = '{}://{}{}'.format(
+                origin[0], urlsplit(url).netloc.rpartition('@')[2], target)
+            request_headers = dict(headers, **proxy[2])
+        conn, res = connection_pool.request(origin, target, request_headers)
+        is_reusable = False
+        try:
+            if res.status in REDIRECT_CODES and header_location in res.headers:
+                url = urljoin(url, res.headers[header_location])
+                res.read(MAX_ERROR_BODY_BYTES)
+                is_reusable = res.isclosed() and not res.will_close
+                continue
+
+            if not HTTPStatus.OK <= res.status < HTTPStatus.MULTIPLE_CHOICES:
+                error_body = res.read(MAX_ERROR_BODY_BYTES)
+                is_reusable = res.isclosed() and not res.will_close
+                raise HTTPError(
+                    url,
+                    res.status,
+                    res.reason,
+                    res.headers,
+                    io.BytesIO(error_body)
+                )
+
+            yield res
+            is_reusable = res.isclosed() and not res.will_close
+            return
+        finally:
+            connection_pool.release(origin, conn, is_reusable)
+
+    raise HTTPError(
+        url,
+        res.status,
+        'Too many redirections',
+        res.headers,
+        io.BytesIO()
+    )
+
+
+def _connect(origin):
+    """Opens a connection to `origin`, a (scheme, host, port) tuple. If a
+    proxy applies to `origin` the connection goes to the proxy instead, with
+    a CONNECT tunnel to `origin` for https.
+
+    :rtype http.client.HTTPConnection
+    """
+    scheme, host, port = origin
+    proxy = _proxy(origin)
+    connect_host, connect_port = (host, port) if proxy is None else proxy[:2]
+    if scheme == 'https':
+        conn = http.client.HTTPSConnection(
+            connect_host,
+            connect_port,
+            timeout=UPSTREAM_CONNECT_TIMEOUT,
+            context=_ssl_context()
+        )
+        if proxy is not None:
+            conn.set_tunnel(host, port, headers=proxy[2])
+    else:
+        conn = http.client.HTTPConnection(
+            connect_host,
+            connect_port,
+            timeout=UPSTREAM_CONNECT_TIMEOUT
+        )
+    try:
+        conn.connect()
+    except OSError as e:
+        conn.close()
+        raise URLError(e)
+    conn.sock.settimeout(UPSTREAM_READ_TIMEOUT)
+    return conn
+
+
+async def _connect_async(origin):
+    """Async counterpart of `_connect`
+
+    :rtype (asyncio.StreamReader, asyncio.StreamWriter)
+    """
+    scheme, host, port = origin
+    try:
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                host,
+                port,
+                ssl=_ssl_context() if scheme == 'https' else None
+            ),
+            UPSTREAM_CONNECT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise URLError('timed out')
+    except OSError as e:
+        raise URLError(e)
+
+
+async def _with_read_timeout(awaitable):
+    try:
+        return await asyncio.wait_for(awaitable, UPSTREAM_READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise URLError('timed out')
+
+
+def _proxy(origin):
+    """Returns the proxy to use for `origin` according to the `http_proxy`,
+    `https_proxy` and `no_proxy` environment variables, like `urlopen` does
+
+    :param origin: (scheme, host, port) of the upstream
+    :type origin: (str, str, int)
+    :return host and port of the proxy and the headers to send to it, or
+            None if the upstream is reached directly
+    :rtype (str, int, dict) | None
+    """
+    scheme, host, port = origin
+    proxy_url = getproxies().get(scheme)
+    if not proxy_url or proxy_bypass('{}:{}'.format(host, port)):
+        return None
+    if '://' not in proxy_url:
+        proxy_url = 'http://' + proxy_url
+    parts = urlsplit(proxy_url)
+    headers = {}
+    if parts.username is not None:
+        credentials = '{}:{}'.format(
+            unquote(parts.username), unquote(parts.password or ''))
+        headers['Proxy-Authorization'] = 'Basic {}'.format(
+            base64.b64encode(credentials.encode()).decode('ascii'))
+    return parts.hostname, parts.port or 80, headers
+
+
+def _split_url(url):
+    """Returns the origin, a (scheme, host, port) tuple, and the request
+    target of `url`
+
+    :rtype ((str, str, int), str)
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise URLError('unknown url type: {}'.format(parts.scheme))
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    target = parts.path or '/'
+    if parts.query:
+        target = '{}?{}'.format(target, parts.query)
+    return (parts.scheme, parts.hostname, port), target
+
+
+def _parse_response_head(head):
+    """Parses the status line and headers of a response
+
+    :param head: the response up to and including the empty line
+    :type head: bytes
+    :rtype (str, int, str, http.client.HTTPMessage)
+    """
+    status_line, _, header_block = head.partition(b'\r\n')
+    version, status, reason = (
+        status_line.decode('iso-8859-1').rstrip() + ' '
+    ).split(' ', 2)
+    try:
+        status = int(status)
+    except ValueError:
+        raise URLError('Invalid status line {!r}'.format(status_line))
+    return (
+        version,
+        status,
+        reason.strip(),
+        http.client.parse_headers(io.BytesIO(header_block))
+    )
+
+
+def _is_keep_alive(version, status, headers):
+    """Returns whether the connection of a response can be reused once its
+    body was read
+
+    :rtype bool
+    """
+    connection = (headers.get(header_connection) or '').lower()
+    transfer_encoding = (headers.get(header_transfer_encoding) or '').lower()
+    return (
+        version == 'HTTP/1.1' and
+        'close' not in connection and
+        (status in BODYLESS_CODES or
+         transfer_encoding.endswith('chunked') or
+         header_content_length in headers)
+    )
+
+
+async def handle_async(
+        decoded_url,
+        user_agent,
+        accept,
+        accept_encoding,
+        render_pool):
+    """Async counterpart of `handle`. The upstream is fetched on the event
+    loop and the response is rendered in `render_pool`.
+
+    :param decoded_url: The url to be fetched from
+    :type decoded_url: str
+    :param user_agent: User-Agent header value
+    :type user_agent: str
+    :param accept: Accept header value
+    :param accept_encoding: Accept-Encoding header value
+    :type accept_encoding: str | None
+    :param render_pool: executor used to render responses
+    :type render_pool: concurrent.futures.Executor
+    :return Content type, content encoding (None for identity) and the
+            requested json data
+    :rtype (str, str | None, bytes)
+    """
+    content_type, repo_version = _get_repo_version(accept)
+    dcos_version = _get_dcos_version(user_agent)
+    logger.debug('Version [%s] DC/OS [%s]', repo_version, dcos_version)
+
+    cache_key = (decoded_url, dcos_version, repo_version)
+    cached = response_cache.get(cache_key)
+    if _is_fresh(cached):
+        logger.debug('Serving cached response for [%s]', decoded_url)
+        response_cache_requests.inc(result='hit')
+        json_response = cached.json_response
+    else:
+        response_cache_requests.inc(result='miss')
+        # Concurrent requests for the same repo share one fetch and render
+        json_response = await async_transforms.do(
+            cache_key,
+            _transform_async,
+            cache_key,
+            cached,
+            user_agent,
+            accept,
+            render_pool
+        )
+
+    if _accepts_gzip(accept_encoding):
+        content_encoding = encoding_gzip
+        # zlib releases the GIL, so a thread keeps the event loop responsive
+        json_response = await asyncio.get_running_loop().run_in_executor(
+            None,
+            _gzip_response,
+            cache_key,
+            json_response
+        )
+    else:
+        content_encoding = None
+    _observe_response_size(cache_key, content_encoding, json_response)
+    return content_type, content_encoding, json_response
+
+
+async def _transform_async(cache_key, cached, user_agent, accept, render_pool):
+    """Async counterpart of `_transform`. The response is rendered in
+    `render_pool`.
+
     :return Requested json data
-    :rtype str (a valid json object)
+    :rtype bytes (a valid json object)
+    """
+    decoded_url, dcos_version, repo_version = cache_key
+    req = _upstream_request(decoded_url, user_agent, accept, cached)
+    started_at = time.perf_counter()
+    try:
+        status, reason, headers, resp_content = await _fetch_async(req)
+    except HTTPError as e:
+        if not _is_not_modified(e, cached):
+            raise
+        _observe_fetch(cache_key, time.perf_counter() - started_at)
+        return _revalidate(cache_key, cached)
+    fetch_seconds = time.perf_counter() - started_at
+
+    _log_upstream_response(status, reason, headers)
+    json_response, stats = await asyncio.get_running_loop().run_in_executor(
+        render_pool,
+        render_response,
+        decoded_url,
+        resp_content,
+        headers.get_param(param_charset) or default_charset,
+        dcos_version,
+        repo_version
+    )
+    # Observed once rendering validated the requested repo version
+    _observe_fetch(cache_key, fetch_seconds)
+    _observe_render(cache_key, stats)
+    _cache_response(cache_key, json_response, headers)
+    return json_response
+
+
+async def _fetch_async(req):
+    """Fetches `req` without blocking the event loop. Like `urlopen` it
+    follows redirects and raises HTTPError for any other non 2xx response.
+
+    :param req: the upstream request
+    :type req: urllib.request.Request
+    :return status, reason, headers and body of the response
+    :rtype (int, str, http.client.HTTPMessage, bytes)
+    """
+    url = req.full_url
+    for _ in range(MAX_REDIRECTIONS + 1):
+        origin, target = _split_url(url)
+        if _proxy(origin) is not None:
+            # The streams can't tunnel through a proxy, fall back to the
+            # pooled blocking client on a thread
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                _fetch,
+                Request(url, headers=dict(req.header_items()))
+            )
+        request_lines = ['GET {} HTTP/1.1'.format(target)]
+        request_lines.append(
+            'Host: {}'.format(urlsplit(url).netloc.rpartition('@')[2]))
+        request_lines.extend(
+            '{}: {}'.format(k, v) for k, v in req.header_items()
+        )
+        request_lines.extend(['', ''])
+        reader, writer, version, status, reason, headers = \
+            await async_connection_pool.request(
+                origin,
+                '\r\n'.join(request_lines).encode('iso-8859-1')
+            )
+
+        is_reusable = False
+        try:
+            if status in REDIRECT_CODES and header_location in headers:
+                url = urljoin(url, headers[header_location])
+                continue
+
+            if not HTTPStatus.OK <= status < HTTPStatus.MULTIPLE_CHOICES:
+                error_body = bytearray()
+                async for chunk in _iter_body_async(reader, status, headers):
+                    error_body += chunk
+                    if len(error_body) > MAX_ERROR_BODY_BYTES:
+                        break
+                else:
+                    is_reusable = _is_keep_alive(version, status, headers)
+                raise HTTPError(
+                    url,
+                    status,
+                    reason,
+                    headers,
+                    io.BytesIO(bytes(error_body[:MAX_ERROR_BODY_BYTES]))
+                )
+
+            body = LimitedBody(headers)
+            async for chunk in _iter_body_async(reader, status, headers):
+                body.feed(chunk)
+            is_reusable = _is_keep_alive(version, status, headers)
+            return status, reason, headers, body.finish()
+        except URLError:
+            raise
+        except OSError as e:
+            raise URLError(e)
+        finally:
+            async_connection_pool.release(origin, reader, writer, is_reusable)
+
+    raise HTTPError(
+        url,
+        status,
+        'Too many redirections',
+        headers,
+        io.BytesIO()
+    )
+
+
+async def _iter_body_async(reader, status, headers):
+    """Yields the raw chunks of a response body as they are received,
+    undoing a chunked Transfer-Encoding.
+
+    :param reader: stream positioned at the start of the body
+    :type reader: asyncio.StreamReader
+    :param status: response status code
+    :type status: int
+    :param headers: response headers
+    :type headers: http.client.HTTPMessage
+    """
+    transfer_encoding = (headers.get(header_transfer_encoding) or '').lower()
+    if status in BODYLESS_CODES:
+        return
+    elif transfer_encoding.endswith('chunked'):
+        while True:
+            size_line = await _with_read_timeout(reader.readline())
+            try:
+                remaining = int(size_line.split(b';')[0].strip(), 16)
+            except ValueError:
+                raise URLError('Invalid chunk size {!r}'.format(size_line))
+            if remaining == 0:
+                # Skip the trailers that end the body
+                while (await _with_read_timeout(reader.readline())).strip():
+                    pass
+                return
+            while remaining > 0:
+                chunk = await _with_read_timeout(
+                    reader.read(min(remaining, READ_CHUNK_BYTES))
+                )
+                if not chunk:
+                    raise URLError('Incomplete chunked body')
+                remaining -= len(chunk)
+                yield chunk
+            await _with_read_timeout(reader.readline())
+    elif header_content_length in headers:
+        remaining = int(headers.get(header_content_length))
+        while remaining > 0:
+            chunk = await _with_read_timeout(
+                reader.read(min(remaining, READ_CHUNK_BYTES))
+            )
+            if not chunk:
+                raise URLError('Incomplete body')
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        # The body ends when the upstream closes the connection
+        while True:
+            chunk = await _with_read_timeout(reader.read(READ_CHUNK_BYTES))
+            if not chunk:
+                return
+            yield chunk
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context():
+    return ssl.create_default_context()
+
+
+def _upstream_request(decoded_url, user_agent, accept, cached):
+    """Returns the upstream request, conditional on `cached` if present
+
+    :param decoded_url: The url to be fetched from
+    :type decoded_url: str
+    :param user_agent: User-Agent header value
+    :type user_agent: str
+    :param accept: Accept header value
+    :param cached: the cached response for this request, if any
+    :type cached: CachedResponse | None
+    :rtype urllib.request.Request
     """
     req = Request(decoded_url)
     req.add_header(header_user_agent, user_agent)
     req.add_header(header_accept, accept)
-    logger.debug('\n{}\n{}\n{}'.format(
-        '<--- Upstream Request --->',
-        req.full_url,
-        _format_dict(req.headers)
+    req.add_header(header_accept_encoding, 'gzip, deflate')
+    if cached is not None:
+        if cached.etag:
+            req.add_header(header_if_none_match, cached.etag)
+        if cached.last_modified:
+            req.add_header(header_if_modified_since, cached.last_modified)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            '\n<--- Upstream Request --->\n%s\n%s',
+            req.full_url,
+            _format_dict(req.headers)
+        )
+    return req
+
+
+def _log_upstream_response(status, reason, headers):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            '\n<--- Upstream Response --->\n%s %s\n%s',
+            status,
+            reason,
+            _format_dict(headers)
+        )
+
+
+def _is_fresh(cached):
+    return cached is not None and cached.expires_at > time.monotonic()
+
+
+def _is_not_modified(e, cached):
+    return cached is not None and e.code == HTTPStatus.NOT_MODIFIED
+
+
+def _revalidate(cache_key, cached):
+    """Extends the life of a cached response the upstream did not modify
+
+    :return the cached json data
+    :rtype str
+    """
+    logger.debug('Upstream [%s] not modified', cache_key[0])
+    response_cache.put(
+        cache_key,
+        cached._replace(expires_at=time.monotonic() + RESPONSE_CACHE_TTL)
+    )
+    return cached.json_response
+
+
+def _cache_response(cache_key, json_response, headers):
+    response_cache.put(cache_key, CachedResponse(
+        json_response=json_response,
+        gzip_response=None,
+        etag=headers.get(header_etag),
+        last_modified=headers.get(header_last_modified),
+        expires_at=time.monotonic() + RESPONSE_CACHE_TTL
     ))
-    with urlopen(req, timeout=MAX_TIMEOUT) as res:
-        charset = res.info().get_param(param_charset) or default_charset
 
-        if header_content_length not in res.headers:
-            raise ValueError(ErrorResponse.ENDPOINT_HEADER_MISS.to_msg())
 
-        if int(res.headers.get(header_content_length)) > MAX_BYTES:
-            raise ValueError(ErrorResponse.MAX_SIZE.to_msg())
-        resp_content = res.read().decode(charset)
-        logger.debug('\n{}\n{} {}\n{}\n{}'.format(
-            '<--- Upstream Response --->',
-            res.getcode(),
-            res.reason,
-            _format_dict(res.headers),
-            resp_content if res.getcode() // 200 != 1 else ''
-        ))
-        content_type, repo_version = _get_repo_version(accept)
-        dcos_version = _get_dcos_version(user_agent)
-        logger.debug('Version [%s] DC/OS [%s]', repo_version, dcos_version)
+def _gzip_response(cache_key, json_response):
+    """Returns `json_response` compressed with gzip. The compressed bytes are
+    kept with the cached response so that they are only computed once.
+
+    :param cache_key: (upstream url, dcos version, repo version)
+    :type cache_key: (str, str, str)
+    :param json_response: the rendered response
+    :type json_response: bytes
+    :rtype bytes
+    """
+    cached = response_cache.get(cache_key)
+    is_cached = cached is not None and cached.json_response is json_response
+    if is_cached and cached.gzip_response is not None:
+        return cached.gzip_response
+
+    gzip_response = gzip.compress(json_response, compresslevel=GZIP_LEVEL)
+    if is_cached:
+        response_cache.put(
+            cache_key,
+            cached._replace(gzip_response=gzip_response)
+        )
+    return gzip_response
+
+
+def render_response(
+        decoded_url,
+        resp_content,
+        charset,
+        dcos_version,
+        repo_version):
+    """Parses an upstream repo and returns the json for the requested versions
+
+    :param decoded_url: The url the repo was fetched from
+    :type decoded_url: str
+    :param resp_content: the decoded upstream response body
+    :type resp_content: bytes | bytearray
+    :param charset: charset of the upstream response body
+    :type charset: str
+    :param dcos_version: version of dcos
+    :type dcos_version: str
+    :param repo_version: version of universe repo
+    :type repo_version: str
+    :return filtered json data based on parameters and the stats of the
+            rendering, see `render_json`
+    :rtype (bytes, collections.Counter)
+    """
+    stats = collections.Counter()
+    with _timed(stats, 'parse'):
         try:
-            json_body = json.loads(resp_content)
+            json_body = json.loads(resp_content.decode(charset))
         except ValueError as e:
             logger.exception(e)
             raise ValueError(ErrorResponse.INVALID_JSON_FROM_UPSTREAM.to_msg(decoded_url))
-        assert json_key_packages in json_body, 'Expected key [{}] is not present in response'.format(json_key_packages)
-        return content_type, render_json(
-            json_body[json_key_packages],
-            dcos_version,
-            repo_version
-        )
+    assert json_key_packages in json_body, 'Expected key [{}] is not present in response'.format(json_key_packages)
+    json_response = render_json(
+        json_body[json_key_packages],
+        dcos_version,
+        repo_version,
+        stats
+    )
+    return json_response, stats
 
 
-def render_json(packages, dcos_version, repo_version):
+def render_json(packages, dcos_version, repo_version, stats=None):
     """Returns the json
 
     :param packages: packages list
@@ -206,39 +1459,303 @@ def render_json(packages, dcos_version, repo_version):
     :type dcos_version: str
     :param repo_version: version of universe repo
     :type repo_version: str
+    :param stats: if given, accumulates the seconds spent in every stage of
+                  the rendering and the validation cache hits and misses
+    :type stats: collections.Counter | None
     :return filtered json data based on parameters
-    :rtype str
+    :rtype bytes
     """
-    processed_packages = gen_universe.filter_and_downgrade_packages_by_version(
-        packages,
-        dcos_version
-    )
+    if stats is None:
+        stats = collections.Counter()
+    with _timed(stats, 'filter'):
+        processed_packages = \
+            gen_universe.filter_and_downgrade_packages_by_version(
+                packages,
+                dcos_version
+            )
     packages_dict = {json_key_packages: processed_packages}
-    errors = gen_universe.validate_repo_with_schema(
-        packages_dict,
-        repo_version
-    )
+    with _timed(stats, 'validation'):
+        # Rejects a repo version without a schema even if no package is left
+        # to validate, like validating the whole repo does
+        errors = gen_universe.validate_repo_with_schema(
+            {json_key_packages: []},
+            repo_version
+        )
+        for package in processed_packages:
+            errors.extend(_validate_package(package, repo_version, stats))
     if len(errors) != 0:
         logger.error(errors)
         raise ValueError(ErrorResponse.VALIDATION_ERROR.to_msg(errors))
-    return json.dumps(packages_dict)
+    with _timed(stats, 'serialization'):
+        # Serialized with ensure_ascii, so the encoding can not fail
+        return json.dumps(packages_dict).encode('ascii')
+
+
+def _validate_package(package, repo_version, stats):
+    """Validates a package of a repo, reusing the result of an earlier
+    validation of an identical package.
+
+    :param package: package dictionary
+    :type package: dict
+    :param repo_version: version of universe repo
+    :type repo_version: str
+    :param stats: counts the validation cache hits and misses
+    :type stats: collections.Counter
+    :return list of validation errors
+    :rtype list
+    """
+    digest = hashlib.sha256(
+        json.dumps(package, sort_keys=True).encode()
+    ).hexdigest()
+    key = (digest, repo_version)
+    errors = validation_cache.get(key)
+    if errors is None:
+        stats['validation_cache_miss'] += 1
+        errors = gen_universe.validate_package_with_schema(
+            package,
+            repo_version
+        )
+        validation_cache.put(key, errors)
+    else:
+        stats['validation_cache_hit'] += 1
+    return errors
+
+
+@contextlib.contextmanager
+def _timed(stats, stage):
+    """Adds the seconds spent in the `with` block to `stats[stage]`"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[stage] += time.perf_counter() - started_at
+
+
+def _observe_fetch(cache_key, seconds):
+    _, dcos_version, repo_version = cache_key
+    upstream_fetch_seconds.observe(
+        seconds,
+        dcos_version=dcos_version,
+        repo_version=repo_version
+    )
+
+
+def _observe_render(cache_key, stats):
+    """Records the stats returned by `render_response`. They are recorded by
+    the caller because `async` mode renders in worker processes."""
+    _, dcos_version, repo_version = cache_key
+    for stage, histogram in render_stage_metrics.items():
+        histogram.observe(
+            stats[stage],
+            dcos_version=dcos_version,
+            repo_version=repo_version
+        )
+    validation_cache_requests.inc(
+        stats['validation_cache_hit'],
+        result='hit'
+    )
+    validation_cache_requests.inc(
+        stats['validation_cache_miss'],
+        result='miss'
+    )
+
+
+def _observe_response_size(cache_key, content_encoding, json_response):
+    _, dcos_version, repo_version = cache_key
+    response_size_bytes.observe(
+        len(json_response),
+        dcos_version=dcos_version,
+        repo_version=repo_version,
+        content_encoding=content_encoding or 'identity'
+    )
+
+
+def render_metrics():
+    """Returns the metrics of the converter in the Prometheus text format
+
+    :rtype bytes
+    """
+    return ''.join(
+        metric.render() + '\n' for metric in registered_metrics
+    ).encode('utf-8')
+
+
+def _format_labels(labels):
+    """Formats label pairs as a Prometheus label set
+
+    :param labels: list of (name, value)
+    :type labels: list
+    :rtype str
+    """
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for name, value in labels
+    ))
+
+
+def _accepts_gzip(accept_encoding):
+    """Returns whether an Accept-Encoding header value allows gzip
+
+    :param accept_encoding: Accept-Encoding header value
+    :type accept_encoding: str | None
+    :rtype bool
+    """
+    qualities = {}
+    for coding in (accept_encoding or '').split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    quality = qualities.get(
+        encoding_gzip,
+        qualities.get('x-gzip', qualities.get('*', 0.0))
+    )
+    return quality > 0
+
+
+def _response_headers(content_type, content_encoding, json_response):
+    """Returns the headers of a successful /transform response
+
+    :rtype list
+    """
+    headers = [
+        (header_content_type, content_type),
+        (header_content_length, len(json_response)),
+        (header_vary, header_accept_encoding)
+    ]
+    if content_encoding is not None:
+        headers.append((header_content_encoding, content_encoding))
+    return headers
+
 
+def _parse_transform_request(path, headers):
+    """Parses a /transform request. Raises a ValueError if it is invalid.
 
-def _validate_request(s):
+    :param path: the request path, including the query
+    :type path: str
+    :param headers: the request headers
+    :type headers: http.client.HTTPMessage
+    :return A tuple of (query, decoded_url, user_agent, accept)
+    :rtype (dict, str, str, str)
     """
+    errors = _validate_request(headers)
+    if errors:
+        raise ValueError(errors)
 
-    :param s: The in built base http request handler
-    :type s: BaseHTTPRequestHandler
+    query = dict(parse_qsl(urlparse(path).query))
+    if param_url not in query:
+        raise ValueError(ErrorResponse.PARAM_NOT_PRESENT.to_msg(param_url))
+
+    return (
+        query,
+        query.get(param_url),
+        headers.get(header_user_agent),
+        headers.get(header_accept)
+    )
+
+
+def _validate_request(headers):
+    """
+
+    :param headers: The request headers
+    :type headers: http.client.HTTPMessage
     :return Error message (if any)
     :rtype String or None
     """
-    if header_user_agent not in s.headers:
+    if header_user_agent not in headers:
         return ErrorResponse.HEADER_NOT_PRESENT.to_msg(header_user_agent)
 
-    if header_accept not in s.headers:
+    if header_accept not in headers:
         return ErrorResponse.HEADER_NOT_PRESENT.to_msg(header_accept)
 
 
+def _error_response(e, query, user_agent, accept):
+    """Logs an error raised while handling a /transform request and returns
+    the response status and explanation for it.
+
+    :param e: the error
+    :type e: Exception
+    :return A tuple of (status, explanation)
+    :rtype (HTTPStatus, str)
+    """
+    decoded_url = query.get(param_url)
+    if isinstance(e, ValueError):
+        return HTTPStatus.BAD_REQUEST, str(e)
+    elif isinstance(e, HTTPError):
+        logger.info(
+            'Upstream error :\nURL: [%s]\nReason: [%s %s]\nBody:\n[%s]',
+            decoded_url,
+            e.code,
+            e.reason,
+            e.read(),
+            exc_info=e
+        )
+        return HTTPStatus.BAD_GATEWAY, str(e)
+    elif isinstance(e, URLError):
+        logger.info(
+            'Route error :\nURL: [%s]\nReason: [%s]',
+            decoded_url,
+            e.reason,
+            exc_info=e
+        )
+        return HTTPStatus.BAD_GATEWAY, str(e)
+    else:
+        logger.error(
+            'Unhandled exception for [{}] UA [{}] Accept [{}]'.format(
+                query,
+                user_agent,
+                accept
+            ),
+            exc_info=e
+        )
+        return (
+            HTTPStatus.BAD_REQUEST,
+            e.message if hasattr(e, 'message') else str(e)
+        )
+
+
+def _error_page(status, explain):
+    """Returns the error response `BaseHTTPRequestHandler.send_error` sends
+
+    :return A tuple of (status, headers, body)
+    :rtype (HTTPStatus, list, bytes)
+    """
+    status = HTTPStatus(status)
+    body = (DEFAULT_ERROR_MESSAGE % {
+        'code': status.value,
+        'message': html.escape(status.phrase, quote=False),
+        'explain': html.escape(explain, quote=False)
+    }).encode('UTF-8', 'replace')
+    return status, [
+        (header_content_type, DEFAULT_ERROR_CONTENT_TYPE),
+        (header_content_length, len(body))
+    ], body
+
+
+def _format_response(status, headers, body):
+    """Serializes an HTTP/1.0 response. The connection is closed after it.
+
+    :rtype bytes
+    """
+    lines = ['HTTP/1.0 {} {}'.format(status.value, status.phrase)]
+    lines.append('Date: {}'.format(email.utils.formatdate(usegmt=True)))
+    lines.extend('{}: {}'.format(k, v) for k, v in headers)
+    lines.extend(['Connection: close', '', ''])
+    return '\r\n'.join(lines).encode('iso-8859-1') + body
+
+
 def _get_repo_version(accept_headers) -> (str, str):
     """Returns the version of the universe repo parsed.
 
@@ -291,7 +1808,7 @@ class ErrorResponse(Enum):
     UNABLE_PARSE = 'Unable to parse header {}:{}'
     VALIDATION_ERROR = 'Validation errors during processing {}'
     MAX_SIZE = 'Endpoint response exceeds maximum content size'
-    ENDPOINT_HEADER_MISS = 'Endpoint doesn\'t return Content-Length header'
+    UNSUPPORTED_ENCODING = 'Endpoint response has unsupported Content-Encoding {}'
     INVALID_JSON_FROM_UPSTREAM = 'Upstream [{}] did not return a json body'
 
     def to_msg(self, *args):
@@ -15,9 +15,27 @@ python3 -m venv ${REPO_BASE_DIR}/target/venv
 # Install dependencies
 ${REPO_BASE_DIR}/target/venv/bin/pip install -r ${SCRIPTS_DIR}/requirements/requirements.txt
 
-"${REPO_BASE_DIR}"/target/venv/bin/python3 "$SCRIPTS_DIR"/validate_packages.py
+# Reuse previously generated packages when GEN_UNIVERSE_CACHE_DIR is set. It
+# must not point inside target/ since everything there is published.
+GEN_UNIVERSE_ARGS=()
+if [[ -n "${GEN_UNIVERSE_CACHE_DIR:-}" ]]; then
+  GEN_UNIVERSE_ARGS+=(--cache-dir="${GEN_UNIVERSE_CACHE_DIR}")
+fi
+
+# Reuse previous template check results when VALIDATE_PACKAGES_CACHE_DIR is
+# set. The same restriction applies.
+VALIDATE_PACKAGES_ARGS=()
+if [[ -n "${VALIDATE_PACKAGES_CACHE_DIR:-}" ]]; then
+  VALIDATE_PACKAGES_ARGS+=(--cache-dir="${VALIDATE_PACKAGES_CACHE_DIR}")
+fi
+
+# Validate the revisions with one worker process per CPU
+"${REPO_BASE_DIR}"/target/venv/bin/python3 "$SCRIPTS_DIR"/validate_packages.py \
+  --jobs="$(getconf _NPROCESSORS_ONLN)" \
+  ${VALIDATE_PACKAGES_ARGS[@]+"${VALIDATE_PACKAGES_ARGS[@]}"}
 "${REPO_BASE_DIR}"/target/venv/bin/python3 "$SCRIPTS_DIR"/gen_universe.py \
-  --repository="${REPO_BASE_DIR}"/repo/packages/ --out-dir="${REPO_BASE_DIR}"/target/
+  --repository="${REPO_BASE_DIR}"/repo/packages/ --out-dir="${REPO_BASE_DIR}"/target/ \
+  ${GEN_UNIVERSE_ARGS[@]+"${GEN_UNIVERSE_ARGS[@]}"}
 
 # Delete virtual environment
 rm -rf ${REPO_BASE_DIR}/target/venv
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import os
-from distutils.version import LooseVersion
 import argparse
 import base64
+import bisect
 import collections
+import concurrent.futures
 import copy
+import functools
+import hashlib
 import itertools
 import json
 import jsonschema
@@ -12,14 +15,37 @@ import pathlib
 import shutil
 import sys
 import tempfile
+import threading
 import re
 import zipfile
+from json_document import load_json_document
 
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 schema_dir = os.environ.get("SCHEMA_DIR", "{}/../repo/meta/schema/".format(dir_path))
 repo_definitions_json = "{}/vX-repo-definitions.json".format(schema_dir)
 
+# Files of a package revision that contribute to its generated package. Bump
+# PACKAGE_CACHE_VERSION whenever generate_package changes its output so that
+# stale entries in a --cache-dir are ignored.
+PACKAGE_FILES = [
+    'package.json',
+    'resource.json',
+    'config.json',
+    'command.json',
+    'marathon.json.mustache'
+]
+PACKAGE_CACHE_VERSION = '1'
+
+# DC/OS versions that repo-up-to-<version>.json files are rendered for
+JSON_FILE_DCOS_VERSIONS = ["1.8", "1.9", "1.10", "1.11", "1.12", "1.13", "2.0"]
+
+# Repo validators, one set per thread. See _get_repo_validator.
+_repo_validators = threading.local()
+
+# Components of a version string, as split by distutils' LooseVersion
+_version_component_re = re.compile(r'(\d+ | [a-z]+ | \.)', re.VERBOSE)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -34,11 +60,39 @@ def main():
     parser.add_argument(
         '--out-dir',
         dest='outdir',
-        required=True,
         type=pathlib.Path,
-        help='Path to the directory to use to store all universe objects')
+        help='Path to the directory to use to store all universe objects. '
+        'Required unless --changed-since is used')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of worker processes used to read the packages. '
+        'Defaults to 1 (no worker processes)')
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        type=pathlib.Path,
+        help='Path to a directory used to cache generated packages between '
+        'runs. Revisions whose files did not change are not read again')
+    parser.add_argument(
+        '--changed-since',
+        dest='changed_since',
+        help='Git revision, e.g. HEAD. Only the packages changed since then, '
+        'including uncommitted changes, are generated and validated against '
+        'the repo schemas. No universe objects are written')
     args = parser.parse_args()
 
+    if args.changed_since is not None:
+        return check_changed_packages(
+            args.repository,
+            args.changed_since,
+            args.jobs
+        )
+
+    if args.outdir is None:
+        parser.error('the following arguments are required: --out-dir')
+
     if not args.outdir.is_dir():
         print('The path in --out-dir [{}] is not a directory. Please create it'
               ' before running this script.'.format(args.outdir))
@@ -53,14 +107,10 @@ def main():
             args.repository))
         return
 
-    packages = [
-        generate_package_from_path(
-            args.repository,
-            package_name,
-            release_version)
-        for package_name, release_version
-        in enumerate_dcos_packages(args.repository)
-    ]
+    if args.cache_dir is not None:
+        args.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    packages = generate_packages(args.repository, args.jobs, args.cache_dir)
 
     # Render entire universe
     universe_path = args.outdir / 'universe.json'
@@ -76,12 +126,92 @@ def main():
     ct_empty_path = args.outdir / 'repo-empty-v3.content_type'
     create_content_type_file(ct_empty_path, "v3")
 
-    json_file_dcos_versions = ["1.8", "1.9", "1.10", "1.11", "1.12", "1.13", "2.0"]
-    # create universe-by-version files for `json_file_dcos_versions`
-    [render_universe_by_version(
-        args.outdir, copy.deepcopy(packages), version) for version in json_file_dcos_versions]
-    for dcos_version in json_file_dcos_versions:
-        _populate_dcos_version_json_to_folder(dcos_version, args.outdir)
+    # create universe-by-version files for `JSON_FILE_DCOS_VERSIONS`
+    repos = filter_and_downgrade_packages_by_versions(
+        packages, JSON_FILE_DCOS_VERSIONS)
+    for version, version_packages in repos.items():
+        render_universe_by_version(args.outdir, version_packages, version)
+    for dcos_version, version_packages in repos.items():
+        _populate_dcos_version_json_to_folder(
+            dcos_version, args.outdir, version_packages)
+
+
+def check_changed_packages(root, base_revision, jobs=1):
+    """Generates the packages changed since `base_revision` and validates
+    them for every DC/OS version, without writing universe objects.
+
+    :param root: path to the root of the repository
+    :type root: pathlib.Path
+    :param base_revision: git revision to compare with
+    :type base_revision: str
+    :param jobs: number of worker processes to use; 1 reads in this process
+    :type jobs: int
+    :rtype: None
+    """
+    package_names = changed_packages(root, base_revision)
+    if package_names is not None and not package_names:
+        print('No package changed since {}'.format(base_revision))
+        return
+
+    packages = generate_packages(
+        root, jobs, selected_packages=package_names)
+    repos = filter_and_downgrade_packages_by_versions(
+        packages, JSON_FILE_DCOS_VERSIONS)
+    for version, version_packages in repos.items():
+        _validate_repo(
+            'of packages changed since {}'.format(base_revision),
+            {'packages': version_packages},
+            version
+        )
+    print('Validated {} package revision(s)'.format(len(packages)))
+
+
+def changed_packages(root, base_revision):
+    """Returns the names of the packages with files changed since
+    `base_revision`, including changes that are not committed yet.
+
+    :param root: path to the root of the repository
+    :type root: pathlib.Path
+    :param base_revision: git revision to compare with, e.g. HEAD
+    :type base_revision: str
+    :return: the package names, or None when the schemas or these scripts
+             changed and every package needs to be checked
+    :rtype: {str} | None
+    """
+    # Imported here since only this mode needs git, e.g. not the converter
+    import git
+
+    repo = git.Repo(str(root), search_parent_directories=True)
+    work_tree = pathlib.Path(repo.working_tree_dir).resolve()
+    root = root.resolve()
+    shared_dirs = [
+        pathlib.Path(schema_dir).resolve(),
+        pathlib.Path(dir_path).resolve()
+    ]
+
+    paths = set(repo.untracked_files)
+    for diff in repo.commit(base_revision).diff(None):
+        paths.update(path for path in (diff.a_path, diff.b_path) if path)
+
+    package_names = set()
+    for path in paths:
+        path = work_tree / path
+        if any(_is_relative_to(path, shared) for shared in shared_dirs):
+            return None
+        if _is_relative_to(path, root):
+            # <letter>/<package>/<revision>/<file>
+            parts = path.relative_to(root).parts
+            if len(parts) >= 2:
+                package_names.add(parts[1])
+    return package_names
+
+
+def _is_relative_to(path, other):
+    try:
+        path.relative_to(other)
+        return True
+    except ValueError:
+        return False
 
 
 def get_universe_version_for_dcos(dcos_version):
@@ -95,9 +225,9 @@ def get_universe_version_for_dcos(dcos_version):
     :return The packaging version
     :rtype: str
     """
-    if LooseVersion(dcos_version) <= LooseVersion("1.9"):
+    if parse_version(dcos_version) <= parse_version("1.9"):
         return "v3"
-    elif LooseVersion(dcos_version) <= LooseVersion("1.11"):
+    elif parse_version(dcos_version) <= parse_version("1.11"):
         return "v4"
     else:
         return "v5"
@@ -109,18 +239,18 @@ def render_universe_by_version(outdir, packages, version):
 
     :param outdir: Path to the directory to use to store all universe objects
     :type outdir: str
-    :param packages: package dictionary
-    :type packages: dict
+    :param packages: packages already filtered and downgraded for `version`
+    :type packages: [dict]
     :param version: DC/OS version
     :type version: str
     :rtype: None
     """
 
-    if LooseVersion(version) < LooseVersion("1.8"):
+    if parse_version(version) < parse_version("1.8"):
         print("zip based universe files are no longer maintained")
     else:
         file_path = render_json_by_version(outdir, packages, version)
-        _validate_repo(file_path, version)
+        _validate_repo(file_path, {'packages': packages}, version)
         create_content_type_file(
             outdir / 'repo-up-to-{}.content_type'.format(version),
             get_universe_version_for_dcos(version)
@@ -128,9 +258,12 @@ def render_universe_by_version(outdir, packages, version):
 
 
 def json_escape_compatibility(schema: collections.OrderedDict) -> collections.OrderedDict:
-    """ Further escape any singly escaped stringified JSON in config """
+    """ Further escape any singly escaped stringified JSON in config. Returns
+    a new mapping and leaves `schema` untouched. """
 
-    for value in schema.values():
+    escaped = collections.OrderedDict()
+    for key, value in schema.items():
+        value = value.copy()
         if "description" in value:
             value["description"] = escape_json_string(value["description"])
 
@@ -140,7 +273,9 @@ def json_escape_compatibility(schema: collections.OrderedDict) -> collections.Or
             elif value["type"] == "object" and "properties" in value:
                 value["properties"] = json_escape_compatibility(value["properties"])
 
-    return schema
+        escaped[key] = value
+
+    return escaped
 
 
 def escape_json_string(string: str) -> str:
@@ -176,16 +311,14 @@ def render_json_by_version(outdir, packages, version):
 
     :param outdir: Path to the directory to use to store all universe objects
     :type outdir: str
-    :param packages: package dictionary
-    :type packages: dict
+    :param packages: packages already filtered and downgraded for `version`
+    :type packages: [dict]
     :param version: DC/OS version
     :type version: str
     :return: the path where the universe was stored
     :rtype: str
     """
 
-    packages = filter_and_downgrade_packages_by_version(packages, version)
-
     json_file_path = outdir / 'repo-up-to-{}.json'.format(version)
     with json_file_path.open('w', encoding='utf-8') as universe_file:
         json.dump({'packages': packages}, universe_file)
@@ -202,34 +335,103 @@ def filter_and_downgrade_packages_by_version(packages, version):
     :return packages filtered (and may be downgraded) on `version`
     :rtype package dictionary
     """
-    packages = [
-        package for package in packages if filter_by_version(package, version)
-    ]
+    return filter_and_downgrade_packages_by_versions(
+        packages, [version])[version]
 
-    if LooseVersion(version) < LooseVersion('1.10'):
-        # Prior to 1.10, Cosmos had a rendering bug that required
-        # stringified JSON to be doubly escaped. This was corrected
-        # in 1.10, but it means that packages with stringified JSON parameters
-        # that need to bridge versions must be accommodated.
-        #
-        # < 1.9 style escaping:
-        # \\\"field\\\": \\\"value\\\"
-        #
-        # >= 1.10 style escaping:
-        # \"field\": \"value\"
-        for package in packages:
-            if "config" in package and "properties" in package["config"]:
-                # The rough shape of a config file is:
-                # {
-                #   "schema": ...,
-                #   "properties": { }
-                # }
-                # Send just the top level properties in to the recursive
-                # function json_escape_compatibility.
-                package["config"]["properties"] = json_escape_compatibility(
-                    package["config"]["properties"])
-        packages = [downgrade_package_to_v3(package) for package in packages]
-    return packages
+
+def filter_and_downgrade_packages_by_versions(packages, versions):
+    """Filter and downgrade packages for every version in `versions` in a
+    single pass. Neither `packages` nor the package dictionaries are modified.
+    Downgraded packages are shallow overlays that share unchanged fields with
+    the original package, and one overlay is shared by all versions that need
+    it.
+
+    :param packages: package dictionary
+    :type packages: dict
+    :param versions: DC/OS versions
+    :type versions: [str]
+    :return packages filtered (and may be downgraded) for each version
+    :rtype collections.OrderedDict
+    """
+    packages = list(packages)
+    index = VersionIndex(packages)
+    downgraded = {}
+    repos = collections.OrderedDict()
+    for version in versions:
+        needs_downgrade = parse_version(version) < parse_version('1.10')
+        version_packages = []
+        for position in index.positions_up_to(version):
+            package = packages[position]
+            if needs_downgrade:
+                if position not in downgraded:
+                    downgraded[position] = \
+                        _downgrade_package_for_escaping(package)
+                package = downgraded[position]
+            version_packages.append(package)
+        repos[version] = version_packages
+    return repos
+
+
+class VersionIndex:
+    """Positions of packages sorted by their minDcosReleaseVersion. Finding
+    the packages available to a DC/OS version is a bisect instead of a
+    version comparison per package.
+
+    :param packages: package dictionaries
+    :type packages: [dict]
+    """
+
+    def __init__(self, packages):
+        keys = sorted(
+            (_min_dcos_release_version(package), position)
+            for position, package in enumerate(packages)
+        )
+        self._versions = [version for version, _ in keys]
+        self._positions = [position for _, position in keys]
+
+    def positions_up_to(self, version):
+        """Returns the positions of the packages available to `version`, in
+        the order of the indexed packages.
+
+        :param version: DC/OS version
+        :type version: str
+        :rtype: [int]
+        """
+        end = bisect.bisect_right(self._versions, parse_version(version))
+        return sorted(self._positions[:end])
+
+
+def _downgrade_package_for_escaping(package):
+    """Returns the package as served to DC/OS versions before 1.10.
+
+    :param package: package dictionary
+    :type package: dict
+    :return a v3 or v2 package
+    :rtype dict
+    """
+    # Prior to 1.10, Cosmos had a rendering bug that required
+    # stringified JSON to be doubly escaped. This was corrected
+    # in 1.10, but it means that packages with stringified JSON parameters
+    # that need to bridge versions must be accommodated.
+    #
+    # < 1.9 style escaping:
+    # \\\"field\\\": \\\"value\\\"
+    #
+    # >= 1.10 style escaping:
+    # \"field\": \"value\"
+    package = downgrade_package_to_v3(package)
+    if "config" in package and "properties" in package["config"]:
+        # The rough shape of a config file is:
+        # {
+        #   "schema": ...,
+        #   "properties": { }
+        # }
+        # Send just the top level properties in to the recursive
+        # function json_escape_compatibility.
+        config = package["config"].copy()
+        config["properties"] = json_escape_compatibility(config["properties"])
+        package["config"] = config
+    return package
 
 
 def filter_by_version(package, version):
@@ -242,13 +444,28 @@ def filter_by_version(package, version):
     :rtype: bool
     """
 
-    package_version = LooseVersion(
-        package.get('minDcosReleaseVersion', '0.0')
-    )
+    return _min_dcos_release_version(package) <= parse_version(version)
 
-    filter_version = LooseVersion(version)
 
-    return package_version <= filter_version
+def _min_dcos_release_version(package):
+    return parse_version(package.get('minDcosReleaseVersion', '0.0'))
+
+
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    """Parses a version into a tuple that compares like distutils'
+    LooseVersion. Results are cached since the same few versions are
+    compared for every package.
+
+    :param version: version string, e.g. "1.10"
+    :type version: str
+    :rtype: tuple
+    """
+    return tuple(
+        int(component) if component.isdecimal() else component
+        for component in _version_component_re.split(version)
+        if component and component != '.'
+    )
 
 
 def package_path(root, package_name, release_version):
@@ -277,9 +494,7 @@ def read_package(path):
     :rtype: dict
     """
 
-    path = path / 'package.json'
-    with path.open(encoding='utf-8') as file_object:
-        return json.load(file_object)
+    return load_json_document(path / 'package.json').data
 
 
 def read_resource(path):
@@ -293,8 +508,7 @@ def read_resource(path):
     path = path / 'resource.json'
 
     if path.is_file():
-        with path.open(encoding='utf-8') as file_object:
-            return json.load(file_object)
+        return load_json_document(path).data
 
 
 def read_marathon_template(path):
@@ -323,12 +537,8 @@ def read_config(path):
     path = path / 'config.json'
 
     if path.is_file():
-        with path.open(encoding='utf-8') as file_object:
-            # Load config file into a OrderedDict to preserve order
-            return json.load(
-                file_object,
-                object_pairs_hook=collections.OrderedDict
-            )
+        # Objects keep the order of their properties
+        return load_json_document(path).data
 
 
 def read_command(path):
@@ -342,11 +552,14 @@ def read_command(path):
     path = path / 'command.json'
 
     if path.is_file():
-        with path.open(encoding='utf-8') as file_object:
-            return json.load(file_object)
+        return load_json_document(path).data
 
 
-def generate_package_from_path(root, package_name, release_version):
+def generate_package_from_path(
+        root,
+        package_name,
+        release_version,
+        cache_dir=None):
     """Returns v3 package metadata for the specified package
 
     :param root: path to the root of the repository
@@ -355,10 +568,70 @@ def generate_package_from_path(root, package_name, release_version):
     :type package_name: str
     :param release_version: package release version
     :type release_version: int
+    :param cache_dir: directory of previously generated packages, if any
+    :type cache_dir: pathlib.Path | None
     :rtype: dict
     """
 
     path = package_path(root, package_name, release_version)
+
+    if cache_dir is None:
+        return _read_package_from_path(path, release_version)
+
+    cache_path = cache_dir / '{}.json'.format(
+        package_digest(path, release_version))
+    if cache_path.is_file():
+        with cache_path.open(encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+
+    package = _read_package_from_path(path, release_version)
+
+    # Write to a temporary file first so that concurrent builds sharing the
+    # cache never observe a partially written entry.
+    with tempfile.NamedTemporaryFile(
+            'w',
+            encoding='utf-8',
+            dir=str(cache_dir),
+            delete=False) as cache_file:
+        json.dump(package, cache_file)
+    os.replace(cache_file.name, str(cache_path))
+
+    return package
+
+
+def package_digest(path, release_version):
+    """Returns a content hash of the files that make up a package revision
+
+    :param path: path to the package
+    :type path: pathlib.Path
+    :param release_version: package release version
+    :type release_version: int
+    :rtype: str
+    """
+
+    digest = hashlib.sha256()
+    digest.update('{}\0{}\0'.format(
+        PACKAGE_CACHE_VERSION, release_version).encode())
+    for file_name in PACKAGE_FILES:
+        file_path = path / file_name
+        if file_path.is_file():
+            content = file_path.read_bytes()
+            digest.update('{}\0{}\0'.format(
+                file_name, len(content)).encode())
+            digest.update(content)
+    return digest.hexdigest()
+
+
+def _read_package_from_path(path, release_version):
+    """Reads the files of a package revision into a v3 package
+
+    :param path: path to the package
+    :type path: pathlib.Path
+    :param release_version: package release version
+    :type release_version: int
+    :rtype: dict
+    """
+
     return generate_package(
         release_version,
         read_package(path),
@@ -411,6 +684,52 @@ def generate_package(
     return package
 
 
+def generate_packages(root, jobs=1, cache_dir=None, selected_packages=None):
+    """Returns v3 package metadata for every package in the repository. The
+    packages are returned in enumeration order regardless of `jobs`.
+
+    :param root: path to the root of the repository
+    :type root: pathlib.Path
+    :param jobs: number of worker processes to use; 1 reads in this process
+    :type jobs: int
+    :param cache_dir: directory of previously generated packages, if any
+    :type cache_dir: pathlib.Path | None
+    :param selected_packages: only generate the packages with these names,
+                              if given
+    :type selected_packages: {str} | None
+    :rtype: [dict]
+    """
+
+    package_names, release_versions = [], []
+    for package_name, release_version in enumerate_dcos_packages(root):
+        if (selected_packages is not None and
+                package_name not in selected_packages):
+            continue
+        package_names.append(package_name)
+        release_versions.append(release_version)
+
+    if jobs <= 1:
+        return list(map(
+            generate_package_from_path,
+            itertools.repeat(root),
+            package_names,
+            release_versions,
+            itertools.repeat(cache_dir)
+        ))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Executor.map yields results in submission order, which keeps the
+        # rendered repos identical to a serial build.
+        return list(executor.map(
+            generate_package_from_path,
+            itertools.repeat(root),
+            package_names,
+            release_versions,
+            itertools.repeat(cache_dir),
+            chunksize=max(1, len(package_names) // (jobs * 4))
+        ))
+
+
 def enumerate_dcos_packages(packages_path):
     """Enumerate all of the package and release version to include
 
@@ -449,14 +768,15 @@ def v3_to_v2_package(v3_package):
 
 
 def v4_to_v3_package(v4_package):
-    """Converts a v4 package to a v3 package
+    """Converts a v4 package to a v3 package. The result is a shallow copy
+    that shares all unchanged fields with `v4_package`.
 
     :param v4_package: a v3 package
     :type v4_package: dict
     :return: a v3 package
     :rtype: dict
     """
-    package = copy.deepcopy(v4_package)
+    package = v4_package.copy()
     package.pop('upgradesFrom', None)
     package.pop('downgradesTo', None)
     package["packagingVersion"] = "3.0"
@@ -465,7 +785,7 @@ def v4_to_v3_package(v4_package):
 
 def downgrade_package_to_v3(package):
     """Converts a v4 package to a v3 package. If given a v3 or v2 package
-    it creates a deep copy of it, but does not modify it. It does not
+    it creates a shallow copy of it, but does not modify it. It does not
     modify the original package.
 
     :param package: v4, v3, or v2 package
@@ -475,7 +795,7 @@ def downgrade_package_to_v3(package):
     """
     packaging_version = package.get("packagingVersion")
     if packaging_version == "2.0" or packaging_version == "3.0":
-        return copy.deepcopy(package)
+        return package.copy()
     else:
         return v4_to_v3_package(package)
 
@@ -487,18 +807,42 @@ def validate_repo_with_schema(repo_json_data, repo_version):
     :param repo_version: version of the repo (e.g.: v4)
     :return: list of validation errors ( length == zero => No errors)
     """
-    validator = jsonschema.Draft4Validator(
-        _load_jsonschema(repo_version),
-        resolver=jsonschema.RefResolver('file://' + repo_definitions_json, None))
+    validator = _get_repo_validator(repo_version)
+    return _format_validation_errors(validator.iter_errors(repo_json_data))
+
+
+def validate_package_with_schema(package_json_data, repo_version):
+    """Validates a single package of a repo against the corresponding schema.
+    Returns the same errors validate_repo_with_schema reports for a repo that
+    contains the package.
+
+    :param package_json_data: The json of a package in the repo
+    :param repo_version: version of the repo (e.g.: v4)
+    :return: list of validation errors ( length == zero => No errors)
+    """
+    validator = _get_repo_validator(repo_version)
+    package_schema = validator.schema['properties']['packages']['items']
+    return _format_validation_errors(
+        validator.iter_errors(package_json_data, package_schema))
+
+
+def _format_validation_errors(validation_errors):
+    """Formats the sub errors of each validation error
+
+    :param validation_errors: errors reported by a repo validator
+    :type validation_errors: iterable of jsonschema.ValidationError
+    :return: list of validation errors
+    :rtype: [str]
+    """
     errors = []
-    for error in validator.iter_errors(repo_json_data):
+    for error in validation_errors:
         for suberror in sorted(error.context, key=lambda e: e.schema_path):
             errors.append('{}: {}'.format(list(suberror.schema_path), suberror.message))
     return errors
 
 
-def _populate_dcos_version_json_to_folder(dcos_version, outdir):
-    """Populate the repo-up-to-<dcos-version>.json file to a folder.
+def _populate_dcos_version_json_to_folder(dcos_version, outdir, packages):
+    """Populate the packages of repo-up-to-<dcos-version>.json to a folder.
     The folder structure would be :
         <dcos-version>/
             package/
@@ -509,6 +853,8 @@ def _populate_dcos_version_json_to_folder(dcos_version, outdir):
     :type dcos_version: str
     :param outdir: Path to the directory to use to store all universe objects
     :type outdir: str
+    :param packages: the packages rendered in repo-up-to-<dcos-version>.json
+    :type packages: [dict]
     :return: None
     """
     repo_dir = outdir / dcos_version / 'package'
@@ -517,35 +863,31 @@ def _populate_dcos_version_json_to_folder(dcos_version, outdir):
         [str(p) for p in list(repo_dir.glob('*'))])
     )
     pathlib.Path(repo_dir).mkdir(parents=True)
-    repo_file = pathlib.Path(outdir / 'repo-up-to-{}.json'.format(dcos_version))
-    with repo_file.open('r',  encoding='utf-8') as f:
-        data = json.loads(f.read())
-        packages_dict = {}
+    packages_dict = {}
 
-        for package in data.get('packages'):
-            package_name = package.get('name')
-            package_list = packages_dict.get(package_name, [])
-            package_list.append(package)
-            packages_dict[package_name] = package_list
+    for package in packages:
+        package_name = package.get('name')
+        package_list = packages_dict.get(package_name, [])
+        package_list.append(package)
+        packages_dict[package_name] = package_list
 
-        for package_name, package_list in packages_dict.items():
-            with pathlib.Path(repo_dir / '{}.json'.format(package_name))\
-                        .open('w', encoding='utf-8') as f:
-                json.dump({'packages': package_list}, f)
+    for package_name, package_list in packages_dict.items():
+        with pathlib.Path(repo_dir / '{}.json'.format(package_name))\
+                    .open('w', encoding='utf-8') as f:
+            json.dump({'packages': package_list}, f)
 
 
-def _validate_repo(file_path, version):
-    """Validates a repo JSON file against the given version.
+def _validate_repo(file_path, repo, version):
+    """Validates a repo against the given version.
 
     :param file_path: the path where the universe was stored
     :type file_path: str
+    :param repo: the repo stored at `file_path`
+    :type repo: dict
     :param version: DC/OS version
     :type version: str
     :rtype: None
     """
-    with file_path.open(encoding='utf-8') as repo_file:
-        repo = json.loads(repo_file.read())
-
     errors = validate_repo_with_schema(
         repo,
         get_universe_version_for_dcos(version)
@@ -560,8 +902,52 @@ def _validate_repo(file_path, version):
         )
 
 
+def _get_repo_validator(repo_version):
+    """Returns the Draft4 validator for the repo schema of `repo_version`.
+
+    Validators are built once per thread and reused by later calls. They are
+    not shared between threads because the RefResolver keeps a stack of
+    resolution scopes while it validates.
+
+    :param repo_version: repo schema version
+    :type repo_version: str
+    :rtype: jsonschema.Draft4Validator
+    """
+    validators = getattr(_repo_validators, 'validators', None)
+    if validators is None:
+        validators = _repo_validators.validators = {}
+
+    validator = validators.get(repo_version)
+    if validator is None:
+        # The definitions are handed to the resolver as the referring
+        # document, so `$ref`s into them never touch the file system again.
+        # The URI must be normalized to match the `$ref`s joined against it.
+        resolver = jsonschema.RefResolver(
+            pathlib.Path(repo_definitions_json).resolve().as_uri(),
+            _load_repo_definitions())
+        validator = jsonschema.Draft4Validator(
+            _load_jsonschema(repo_version),
+            resolver=resolver)
+        validators[repo_version] = validator
+    return validator
+
+
+@functools.lru_cache(maxsize=None)
+def _load_repo_definitions():
+    """Opens and parses the definitions shared by the repo schemas. The
+    result is cached and must not be modified.
+
+    :return: the definitions dictionary
+    :rtype: dict
+    """
+    with open(repo_definitions_json, encoding='utf-8') as definitions_file:
+        return json.loads(definitions_file.read())
+
+
+@functools.lru_cache(maxsize=None)
 def _load_jsonschema(repo_version):
-    """Opens and parses the repo schema based on the version provided.
+    """Opens and parses the repo schema based on the version provided. The
+    result is cached and must not be modified.
 
     :param repo_version: repo schema version
     :type repo_version: str
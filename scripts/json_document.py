@@ -0,0 +1,98 @@
+"""Single pass json loading shared by the package checks and generation. Only
+depends on the standard library so that standalone checks such as
+json_dup_key_check.py run without the build requirements."""
+
+import collections
+import functools
+import json
+import re
+
+
+# DCOS-42473 : Packages should NOT contain escaped unicode literals
+ESCAPED_UNICODE_LITERAL = re.compile(r'\\[u][a-fA-F0-9]{4}')
+
+# Control characters, json.dumps escapes most of them as \uXXXX even though
+# they are ASCII
+_control_character_re = re.compile('[\x00-\x1f]')
+
+# Number of parsed documents kept in memory by load_json_document
+DOCUMENT_CACHE_SIZE = 1024
+
+# A parsed json file and what the package checks look for in it. See
+# load_json_document.
+JsonDocument = collections.namedtuple('JsonDocument', [
+    'data',
+    'is_ascii',
+    'duplicate_keys',
+    'escaped_unicode_literals'
+])
+
+
+def load_json_document(path):
+    """Parses a json file. The same pass over the file finds duplicate keys,
+    non-ASCII content and escaped unicode literals, so no check needs to
+    parse the file again. The most recently loaded documents are cached by
+    path, size and modification time and shared by every check and by
+    package generation within a process. The result must not be modified.
+
+    :param path: path to the json file
+    :type path: pathlib.Path
+    :rtype: JsonDocument
+    """
+
+    stat = path.stat()
+    return _load_json_document(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def _load_json_document(path, size, mtime_ns):
+    with open(path, mode='rb') as file_object:
+        content = file_object.read()
+
+    duplicate_keys = []
+    escaped_strings = []
+
+    def object_pairs_hook(pairs):
+        obj = {}
+        for key, value in pairs:
+            if key in obj:
+                duplicate_keys.append(key)
+            obj[key] = value
+            _find_escaped_strings(key, escaped_strings)
+            _find_escaped_strings(value, escaped_strings)
+        return obj
+
+    data = json.loads(
+        content.decode('utf-8'),
+        object_pairs_hook=object_pairs_hook
+    )
+    if not isinstance(data, dict):
+        _find_escaped_strings(data, escaped_strings)
+
+    return JsonDocument(
+        data=data,
+        is_ascii=content.isascii(),
+        duplicate_keys=duplicate_keys,
+        # The literals as they appear when the document is serialized with
+        # non-ASCII characters escaped
+        escaped_unicode_literals=[
+            literal
+            for string in escaped_strings
+            for literal in ESCAPED_UNICODE_LITERAL.findall(json.dumps(string))
+        ]
+    )
+
+
+def _find_escaped_strings(value, escaped_strings):
+    """Adds the strings in `value` that serialize with escaped unicode
+    literals to `escaped_strings`. Objects are skipped, their strings are
+    found when they are parsed.
+    """
+    if isinstance(value, str):
+        if (not value.isascii() or
+                _control_character_re.search(value) or
+                ESCAPED_UNICODE_LITERAL.search(value)):
+            escaped_strings.append(value)
+    elif isinstance(value, list):
+        for item in value:
+            _find_escaped_strings(item, escaped_strings)
@@ -1,32 +1,35 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 import os
+import pathlib
 import sys
-import json
+from json_document import load_json_document
 
 
-class DuplicatedKeysException(Exception):
-    pass
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write(
+            "Syntax: {} path/to/file.json [path/to/file.json ...]\n".format(
+                os.path.basename(__file__)))
+        return 1
 
+    failed = False
+    for path in sys.argv[1:]:
+        try:
+            duplicate_keys = load_json_document(
+                pathlib.Path(path)).duplicate_keys
+        except ValueError as e:
+            sys.stderr.write("Error parsing {}: {}\n".format(path, e))
+            failed = True
+            continue
+        for key in duplicate_keys:
+            sys.stderr.write(
+                "Error validating {}: Duplicate key {!r} in json "
+                "document\n".format(path, key))
+            failed = True
 
-def json_checker(pair):
-    ret = {}
-    for key, value in pair:
-        if key in ret:
-            raise DuplicatedKeysException(
-                "Duplicate key {!r} in json document".format(key))
-        else:
-            ret[key] = value
-    return ret
+    return 1 if failed else 0
 
-if len(sys.argv) != 2:
-    sys.stderr.write(
-        "Syntax: {} path/to/file.json\n".format(os.path.basename(__file__)))
-    sys.exit(1)
 
-try:
-    f = open(sys.argv[1], encoding='utf-8')
-    json.load(f, object_pairs_hook=json_checker)
-except DuplicatedKeysException as e:
-    sys.stderr.write("Error validating %s: %s\n" % (sys.argv[1], e.args[0]))
-    sys.exit(1)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,46 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
 import concurrent.futures
 import contextlib
-import distutils.version
-import fnmatch
+import functools
+import hashlib
+import http.client
 import json
 import os
 import pathlib
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
 
 HTTP_ROOT = "http://master.mesos:8082/"
+# Components of a version string, as split by distutils' LooseVersion
+VERSION_COMPONENT_RE = re.compile(r'(\d+ | [a-z]+ | \.)', re.VERBOSE)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds to wait for a connection or for data from the server
+DOWNLOAD_TIMEOUT = 60
+# HTTP status codes worth retrying a download for. Other errors are permanent.
+RETRYABLE_HTTP_CODES = {408, 429, 500, 502, 503, 504}
+LOCAL_REGISTRY = 'localhost:5000'
+# Incremental builds stack a layer per build on the previous image. Every this
+# many builds the image is built from scratch again.
+MAX_INCREMENTAL_BUILDS = 20
+# Media types of the image manifests the local registry may store
+MANIFEST_MEDIA_TYPES = (
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v1+prettyjws',
+)
+# Talks to the local registry directly, whatever proxy the environment sets
+_registry_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
 
 
 def main():
@@ -73,6 +96,57 @@ def main():
         'will operate. Ensures that only package versions compatible with '
         'that DC/OS version are included. This parameter is required.'
     )
+    parser.add_argument(
+        '--download_cache',
+        help='Path to a directory used to keep downloaded files between runs. '
+        'Files are only downloaded again when their URL changes. Defaults to '
+        'a temporary directory')
+    parser.add_argument(
+        '--download_jobs',
+        type=int,
+        default=5,
+        help='Number of files downloaded at the same time')
+    parser.add_argument(
+        '--download_host_jobs',
+        type=int,
+        default=2,
+        help='Number of files downloaded at the same time from any one host')
+    parser.add_argument(
+        '--download_retries',
+        type=int,
+        default=3,
+        help='Number of times a failed download is retried, with exponential '
+        'backoff. Interrupted downloads resume where they stopped when the '
+        'server supports it')
+    parser.add_argument(
+        '--image_jobs',
+        type=int,
+        default=2,
+        help='Number of docker images mirrored into the local registry at the '
+        'same time')
+    parser.add_argument(
+        '--workdir',
+        help='Path to a directory to build the image in and keep between '
+        'runs, instead of a temporary directory. The artifacts, the registry '
+        'and a manifest of the build are kept there, so a later run only '
+        'fetches what changed and adds it as a new layer on top of the '
+        'previous image. Downloads are cached in it unless --download_cache '
+        'is used')
+    parser.add_argument(
+        '--full_build',
+        action='store_true',
+        default=False,
+        help='Build the image from scratch even if --workdir has a previous '
+        'build')
+    parser.add_argument(
+        '--progress_interval',
+        type=float,
+        default=30,
+        help='Seconds between progress reports. 0 disables them')
+    parser.add_argument(
+        '--report',
+        help='Path to a file to write the timings and failures of the build '
+        'to, as json')
 
     args = parser.parse_args()
 
@@ -81,25 +155,56 @@ def main():
         for spec in args.include.split(',') if spec != ''
     ]
 
-    dcos_version = distutils.version.LooseVersion(args.dcos_version)
-
-    with tempfile.TemporaryDirectory() as dir_path, \
-            run_docker_registry(dir_path / pathlib.Path("registry")):
+    dcos_version = parse_version(args.dcos_version)
+
+    # The registry directory is bind mounted into a container, which needs
+    # an absolute path
+    if args.workdir is not None:
+        args.workdir = os.path.abspath(args.workdir)
+    download_cache = args.download_cache
+    if download_cache is not None:
+        download_cache = os.path.abspath(download_cache)
+    elif args.workdir is not None:
+        download_cache = os.path.join(args.workdir, 'downloads')
+
+    report = BuildReport()
+
+    with working_directory(args.workdir) as dir_path, \
+            tempfile.TemporaryDirectory() as download_dir_path, \
+            run_docker_registry(dir_path / pathlib.Path("registry")), \
+            Downloader(
+                pathlib.Path(download_cache or download_dir_path),
+                args.download_jobs,
+                args.download_host_jobs,
+                args.download_retries,
+                link_dir=pathlib.Path(dir_path, 'blobs'),
+                report=report) as downloader, \
+            ImageMirror(
+                LOCAL_REGISTRY,
+                args.image_jobs,
+                report=report) as image_mirror, \
+            report.print_progress(args.progress_interval):
 
         http_artifacts = dir_path / pathlib.Path("http")
         docker_artifacts = dir_path / pathlib.Path("registry")
         repo_artifacts = dir_path / pathlib.Path("universe/repo/packages")
+        staging_artifacts = dir_path / pathlib.Path("staging")
 
         # There is a race between creating this folder and docker run command
         # creating this volume
         os.makedirs(str(docker_artifacts), exist_ok=True)
 
-        os.makedirs(str(http_artifacts))
+        # The http artifacts and the registry of a previous build are reused,
+        # the repository is always generated again
+        shutil.rmtree(str(dir_path / pathlib.Path("universe")),
+                      ignore_errors=True)
+        os.makedirs(str(http_artifacts), exist_ok=True)
         os.makedirs(str(repo_artifacts))
+        # Left over if a previous build in the working directory was killed
+        shutil.rmtree(str(staging_artifacts), ignore_errors=True)
+        os.makedirs(str(staging_artifacts))
 
-        failed_packages = []
-        failed_resources = []
-        failed_images = []
+        included_packages = []
 
         # This has a short circuit detection of an invalid package
         # If the package is invalid, returns (packageinfo, False)
@@ -110,61 +215,80 @@ def main():
             # Short circuit handling bad packages
             if path is None:
                 return (package, version), False
+            # Everything the package adds to the build is staged, and only
+            # moved into the build once the package is complete
+            staging_path = pathlib.Path(
+                tempfile.mkdtemp(dir=str(staging_artifacts)))
             try:
                 prepare_repository(
                     package,
                     version,
                     path,
                     pathlib.Path(args.repository),
-                    repo_artifacts,
+                    staging_path / 'repo',
                     args.server_url,
                     args.docker_url,
                     args.nonlocal_images,
                     args.nonlocal_cli
                 )
 
-                for url, archive_path in enumerate_http_resources(
-                    package,
-                    version,
-                    path,
-                    args.nonlocal_images,
-                    args.nonlocal_cli
-                ):
-                    # If we get a False response, add to failed_resources
-                    if not add_http_resource(http_artifacts, url, archive_path):
-                        failed_resources.append(url)
+                # The images are mirrored while the http resources download
+                images = [
+                    (name, image_mirror.submit(name))
+                    for name in enumerate_docker_images(path)
+                ]
+
+                report.add_failures('resources', add_http_resources(
+                    downloader,
+                    staging_path / 'http',
+                    enumerate_http_resources(
+                        package,
+                        version,
+                        path,
+                        args.nonlocal_images,
+                        args.nonlocal_cli
+                    )
+                ))
 
-                for name in enumerate_docker_images(path):
+                for name, mirrored in images:
                     try:
-                        download_docker_image(name)
-                        upload_docker_image(name)
+                        mirrored.result()
                     except subprocess.CalledProcessError as e:
                         # If we have an issue with a specific Docker image,
                         # capture the image name and re-throw the exception
-                        failed_images.append(name)
+                        report.add_failures('images', [name])
                         raise e
 
+                commit_staged_package(
+                    staging_path,
+                    repo_artifacts,
+                    http_artifacts
+                )
+                included_packages.append((package, version))
             except (subprocess.CalledProcessError, urllib.error.HTTPError):
                 print('MISSING ASSETS: {}'.format(package))
-                remove_package(package, dir_path)
-                failed_packages.append(package)
+                report.add_failures('packages', [(package, version)])
+            finally:
+                shutil.rmtree(str(staging_path), ignore_errors=True)
 
             return package, True
 
+        selected_packages = list(enumerate_dcos_packages(
+            pathlib.Path(args.repository),
+            packages,
+            args.selected,
+            dcos_version))
+        report.start_packages(len(selected_packages))
         with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            for package in executor.map(
-                handle_package,
-                enumerate_dcos_packages(
-                    pathlib.Path(args.repository),
-                    packages,
-                    args.selected,
-                    dcos_version)):
+            for package in executor.map(handle_package, selected_packages):
                 # Detect second return from handle_package, and on False, notify
                 if package[1]:
                     print("Completed: {}".format(package[0]))
                 else:
                     print("Failed: {}".format(package[0]))
-                    failed_packages.append(package[0])
+                    report.add_failures('packages', [package[0]])
+                report.finish_package()
+        report.finish_stage('packages')
 
         build_repository(
             pathlib.Path(
@@ -175,20 +299,66 @@ def main():
             pathlib.Path(args.repository),
             pathlib.Path(dir_path, 'universe')
         )
+        report.finish_stage('repository')
+
+        # Drop the artifacts of the packages a previous build included
+        remove_stale_http_artifacts(http_artifacts, included_packages)
+        downloader.remove_unused_links()
+
+        previous_manifest = None
+        if args.workdir is not None and not args.full_build:
+            previous_manifest = _read_json_file(
+                pathlib.Path(dir_path, 'manifest.json'))
+        manifest = {
+            'packages': sorted(included_packages),
+            'resources': downloader.digests(),
+            'images': image_mirror.digests(),
+            'files': snapshot_files(
+                pathlib.Path(dir_path),
+                ('http', 'registry', TARGET_PATH)
+            ),
+            'incremental_builds': 0
+        }
+
+        base_image = None
+        if (previous_manifest is not None and
+                previous_manifest['incremental_builds'] <
+                MAX_INCREMENTAL_BUILDS and
+                docker_image_exists(previous_manifest['image'])):
+            base_image = previous_manifest['image']
+            manifest['incremental_builds'] = (
+                previous_manifest['incremental_builds'] + 1)
+            print_manifest_changes(previous_manifest, manifest)
+
+        manifest['image'] = build_universe_docker(
+            pathlib.Path(dir_path),
+            base_image,
+            previous_manifest['files'] if base_image else None,
+            manifest['files']
+        )
+        report.finish_stage('docker_build')
 
-        build_universe_docker(pathlib.Path(dir_path))
+        if args.workdir is not None:
+            _write_json_file(pathlib.Path(dir_path, 'manifest.json'), manifest)
 
-        if failed_packages:
-            print("Errors: {}".format(failed_packages))
-            print("These packages are not included in the image.")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as report_file:
+            json.dump(report.to_json(), report_file, indent=2)
 
-        if failed_images:
-            print("Unable to add these Docker images to the Universe:")
-            print("Missing images: {}".format(failed_images))
+    failed_packages = report.failures('packages')
+    if failed_packages:
+        print("Errors: {}".format(failed_packages))
+        print("These packages are not included in the image.")
 
-        if failed_resources:
-            print("Unable to add these files to the image:")
-            print("Missing files: {}".format(failed_resources))
+    failed_images = report.failures('images')
+    if failed_images:
+        print("Unable to add these Docker images to the Universe:")
+        print("Missing images: {}".format(failed_images))
+
+    failed_resources = report.failures('resources')
+    if failed_resources:
+        print("Unable to add these files to the image:")
+        print("Missing files: {}".format(failed_resources))
 
 
 def enumerate_dcos_packages(
@@ -209,42 +379,66 @@ def enumerate_dcos_packages(
     :type only_selected: boolean
     :param: dcos_version: filter the list of packages to only ones compatible
                           with this DC/OS version; if None, do not filter
-    :type dcos_version: distutils.version.LooseVersion | None
+    :type dcos_version: tuple | None
     :returns: generator of package name, package version and path
     :rtype: gen((str, str, pathlib.Path))
     """
 
-    pending_packages = packages.copy()
-    for letter_path in packages_path.iterdir():
-        assert len(letter_path.name) == 1 and letter_path.name.isupper()
-
-        for package_path in letter_path.iterdir():
-            revision_paths = list(package_path.iterdir())
-            revision_paths.sort(key=lambda r: int(r.name), reverse=True)
-
-            for index, revision_path in enumerate(revision_paths):
-                package_json = load_json(revision_path / 'package.json')
-                if include_revision(
-                    package_json,
-                    pending_packages,
-                    only_selected,
-                    dcos_version,
-                    index == 0  # Latest package will always have an index of 0
-                ):
-                    # *Mutation*. We enumerated the package so let's remove
-                    # it from our pending list if it exists. It may not exists
-                    # if --selected is used.
-                    key = (package_json['name'], package_json['version'])
-                    if key in pending_packages:
-                        pending_packages.remove(key)
-
-                    yield (
-                        package_json['name'],
-                        package_json['version'],
-                        revision_path
-                    )
+    # Package directories are named after their package, so without
+    # --selected only the directories of the included packages are read, and
+    # only until each of their included versions is found. With --selected
+    # only the latest revision of every package can be included.
+    pending_packages = set(packages)
+    pending_versions = collections.defaultdict(set)
+    for name, version in packages:
+        pending_versions[name].add(version)
+
+    if only_selected:
+        package_paths = (
+            package_path
+            for letter_path in packages_path.iterdir()
+            for package_path in _package_paths(letter_path)
+        )
+    else:
+        package_paths = (
+            packages_path / name[:1].upper() / name
+            for name in sorted(pending_versions)
+            if (packages_path / name[:1].upper() / name).is_dir()
+        )
+
+    for package_path in package_paths:
+        revision_paths = list(package_path.iterdir())
+        revision_paths.sort(key=lambda r: int(r.name), reverse=True)
+        if only_selected:
+            revision_paths = revision_paths[:1]
+
+        for index, revision_path in enumerate(revision_paths):
+            if not only_selected and not pending_versions[package_path.name]:
+                break
+
+            package_json = load_json(revision_path / 'package.json')
+            if include_revision(
+                package_json,
+                pending_packages,
+                only_selected,
+                dcos_version,
+                index == 0  # Latest package will always have an index of 0
+            ):
+                # *Mutation*. We enumerated the package so let's remove
+                # it from our pending list if it exists. It may not exists
+                # if --selected is used.
+                key = (package_json['name'], package_json['version'])
+                pending_packages.discard(key)
+                pending_versions[key[0]].discard(key[1])
+
+                yield (
+                    package_json['name'],
+                    package_json['version'],
+                    revision_path
+                )
 
     if pending_packages:
+        pending_packages = sorted(pending_packages)
         print("Error: couldn't find the following packages")
         print(pending_packages)
         for package in pending_packages:
@@ -259,6 +453,11 @@ def enumerate_dcos_packages(
         # sys.exit(1)
 
 
+def _package_paths(letter_path):
+    assert len(letter_path.name) == 1 and letter_path.name.isupper()
+    return letter_path.iterdir()
+
+
 def include_revision(
     package_json,
     packages,
@@ -281,7 +480,7 @@ def version_check(package_json, dcos_version):
     if dcos_version:
         raw_version = package_json.get('minDcosReleaseVersion')
         if raw_version:
-            min_version = distutils.version.LooseVersion(raw_version)
+            min_version = parse_version(raw_version)
             if dcos_version < min_version:
                 return False
     return True
@@ -302,6 +501,22 @@ def selected_check(package_json, packages, only_selected, is_latest):
     return (package_name, package_version) in packages
 
 
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    """Parses a DC/OS release version into a tuple that compares like
+    distutils' LooseVersion
+
+    :param version: version string, e.g. "1.10"
+    :type version: str
+    :rtype: tuple
+    """
+    return tuple(
+        int(component) if component.isdecimal() else component
+        for component in VERSION_COMPONENT_RE.split(version)
+        if component and component != '.'
+    )
+
+
 def load_json(json_path):
     try:
         with json_path.open(encoding='utf-8') as json_file:
@@ -324,15 +539,21 @@ def enumerate_http_resources(
     skip_images,
     skip_cli
 ):
+    """Enumerates the http resources of a package revision
+
+    :returns: generator of the url, the directory to store the resource in
+              and the expected sha256 of the resource, if known
+    :rtype: gen((str, pathlib.Path, str | None))
+    """
     resource = load_json(package_path / 'resource.json')
 
     if not skip_images:
         for name, url in resource.get('images', {}).items():
             if name != 'screenshots':
-                yield url, pathlib.Path(package, version, 'images')
+                yield url, pathlib.Path(package, version, 'images'), None
 
     for name, url in resource.get('assets', {}).get('uris', {}).items():
-        yield url, pathlib.Path(package, version, 'uris')
+        yield url, pathlib.Path(package, version, 'uris'), None
 
     if not skip_cli:
         for os_type, arch_dict in \
@@ -340,7 +561,13 @@ def enumerate_http_resources(
             for arch in arch_dict.items():
                 yield (
                     arch[1]['url'],
-                    pathlib.Path(package, version, 'uris', os_type)
+                    pathlib.Path(package, version, 'uris', os_type),
+                    next(
+                        (content_hash['value']
+                         for content_hash in arch[1].get('contentHash', [])
+                         if content_hash.get('algo') == 'sha256'),
+                        None
+                    )
                 )
 
     command_path = (package_path / 'command.json')
@@ -348,7 +575,7 @@ def enumerate_http_resources(
         commands = load_json(command_path)
 
         for url in commands.get("pip", []):
-            yield url, pathlib.Path(package, version, 'commands')
+            yield url, pathlib.Path(package, version, 'commands'), None
 
 
 def enumerate_docker_images(package_path):
@@ -394,42 +621,863 @@ def format_image_name(host, name):
 def upload_docker_image(name):
     print('Pushing docker image: {}'.format(name))
     command = ['docker', 'tag', name,
-               format_image_name('localhost:5000', name)]
+               format_image_name(LOCAL_REGISTRY, name)]
 
     subprocess.check_call(command)
 
-    command = ['docker', 'push', format_image_name('localhost:5000', name)]
+    command = ['docker', 'push', format_image_name(LOCAL_REGISTRY, name)]
 
     subprocess.check_call(command)
 
 
-def build_universe_docker(dir_path):
+class ImageMirror:
+    """Mirrors docker images into a local registry with a thread pool of its
+    own. Images with the same name in the local registry are mirrored once,
+    and images pinned by digest that the registry already has are not pulled
+    at all. Images referenced by tag are always pulled and pushed, since the
+    tag may point to another image upstream by now. Layers shared
+    by several images are transferred once, since the docker daemon and the
+    registry skip the layers they already have.
+    """
+
+    def __init__(self, registry_host, max_workers=2, report=None):
+        self._registry_host = registry_host
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._report = report or BuildReport()
+        self._lock = threading.Lock()
+        self._mirrored = {}
+        self._names = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown()
+
+    def submit(self, name):
+        """Starts mirroring an image, unless it is already being mirrored
+
+        :param name: the name of the image, e.g. mesosphere/marathon:v1.5.1
+        :type name: str
+        :returns: future that fails with subprocess.CalledProcessError when
+                  the image cannot be mirrored
+        :rtype: concurrent.futures.Future
+        """
+        local_name = format_image_name(self._registry_host, name)
+        with self._lock:
+            mirrored = self._mirrored.get(local_name)
+            if mirrored is None:
+                mirrored = self._executor.submit(
+                    self._mirror,
+                    name,
+                    local_name
+                )
+                self._mirrored[local_name] = mirrored
+                self._names[local_name] = name
+                self._report.submit('images')
+        return mirrored
+
+    def digests(self):
+        """Returns the manifest digest in the registry of every image mirrored
+        successfully. It is empty or None when the registry did not report it.
+
+        :rtype: dict
+        """
+        with self._lock:
+            mirrored = [
+                (self._names[local_name], future)
+                for local_name, future in self._mirrored.items()
+            ]
+        return {
+            name: future.result()
+            for name, future in mirrored
+            if future.done() and future.exception() is None
+        }
+
+    def _mirror(self, name, local_name):
+        self._report.start('images')
+        timings = {'name': name, 'skipped': False, 'error': None}
+        try:
+            digest = None
+            if '@' in name:
+                digest = registry_image_digest(self._registry_host, local_name)
+            if digest is not None:
+                print('Docker image already in the local registry: {}'.format(
+                    name))
+                timings['skipped'] = True
+                return digest
+
+            start = time.monotonic()
+            download_docker_image(name)
+            timings['pull_seconds'] = time.monotonic() - start
+            start = time.monotonic()
+            upload_docker_image(name)
+            timings['push_seconds'] = time.monotonic() - start
+            print(
+                'Mirrored docker image {} (pull {:.1f}s, push {:.1f}s)'.format(
+                    name, timings['pull_seconds'], timings['push_seconds']))
+            return registry_image_digest(self._registry_host, local_name)
+        except Exception as e:
+            timings['error'] = str(e)
+            raise
+        finally:
+            self._report.finish('images', timings)
+
+
+def registry_image_digest(registry_host, local_name):
+    """Returns the manifest digest of an image in a registry, using the
+    registry HTTP API
+
+    :param registry_host: host and port of the registry
+    :type registry_host: str
+    :param local_name: name of the image in the registry, starting with
+                       `registry_host`
+    :type local_name: str
+    :returns: the digest, or None if the registry does not have the image
+    :rtype: str | None
+    """
+    repository = local_name[len(registry_host) + 1:]
+    if '@' in repository:
+        repository, reference = repository.split('@', 1)
+    elif ':' in repository.rsplit('/', 1)[-1]:
+        repository, reference = repository.rsplit(':', 1)
+    else:
+        reference = 'latest'
+
+    request = urllib.request.Request(
+        'http://{}/v2/{}/manifests/{}'.format(
+            registry_host, repository, reference),
+        headers={'Accept': ', '.join(MANIFEST_MEDIA_TYPES)},
+        method='HEAD'
+    )
+    try:
+        with _registry_opener.open(
+                request,
+                timeout=DOWNLOAD_TIMEOUT) as response:
+            return response.headers.get('Docker-Content-Digest', '')
+    except (OSError, http.client.HTTPException):
+        # Not found, or the registry cannot tell; mirror the image anyway
+        return None
+
+
+def build_universe_docker(
+        dir_path,
+        base_image=None,
+        previous_files=None,
+        files=None):
+    """Builds the universe image. Given a `base_image`, only the files that
+    changed since it was built are added, in a new layer on top of it.
+
+    :param dir_path: path to the directory to build the image in
+    :type dir_path: pathlib.Path
+    :param base_image: the image of the previous build, if any
+    :type base_image: str | None
+    :param previous_files: the files of the previous build, see
+                           `snapshot_files`
+    :type previous_files: dict | None
+    :param files: the files of this build, see `snapshot_files`
+    :type files: dict | None
+    :returns: the timestamped tag of the image
+    :rtype: str
+    """
     print('Building the universe docker container')
     current_dir = pathlib.Path(
         os.path.dirname(os.path.realpath(__file__)))
-    shutil.copyfile(
-        str(current_dir / '..' / 'docker' / 'local-universe' / 'Dockerfile'),
-        str(dir_path / 'Dockerfile'))
-
-    command = ['docker', 'build', '-t',
-               'mesosphere/universe:{:.0f}'.format(time.time()),
+    docker_dir = current_dir / '..' / 'docker' / 'local-universe'
+    tag = 'mesosphere/universe:{:.0f}'.format(time.time())
+    command = ['docker', 'build', '-t', tag,
                '-t', 'mesosphere/universe:latest', '.']
 
+    # Only send what the Dockerfile copies to the docker daemon
+    ignored = ['blobs', 'delta', 'downloads', 'manifest.json', 'staging']
+    if base_image is None:
+        shutil.copyfile(
+            str(docker_dir / 'Dockerfile'),
+            str(dir_path / 'Dockerfile'))
+    else:
+        print('Adding the changes since {}'.format(base_image))
+        prepare_delta(dir_path, previous_files, files)
+        shutil.copyfile(
+            str(docker_dir / 'Dockerfile.incremental'),
+            str(dir_path / 'Dockerfile'))
+        ignored = ['blobs', 'downloads', 'http', 'manifest.json', 'registry',
+                   'staging']
+        command[2:2] = ['--build-arg', 'BASE_IMAGE={}'.format(base_image)]
+
+    with (dir_path / '.dockerignore').open('w', encoding='utf-8') as f:
+        f.write('\n'.join(ignored) + '\n')
+
     subprocess.check_call(command, cwd=str(dir_path))
+    return tag
+
+
+# Where the directories of the build are copied to in the image
+IMAGE_PATHS = {
+    'http': '/usr/share/nginx/html',
+    'registry': '/var/lib/registry',
+}
+# The universe objects rendered by gen_universe. Every build copies all of
+# them, since the repository is rebuilt from scratch.
+TARGET_PATH = 'universe/target'
+
+
+def prepare_delta(dir_path, previous_files, files):
+    """Links the http and registry files that are new or changed since the
+    previous build into `dir_path`/delta, and lists the image paths of the
+    files the previous build had and this one does not in
+    `dir_path`/delta/removed.txt
+
+    :param dir_path: path to the directory to build the image in
+    :type dir_path: pathlib.Path
+    :param previous_files: the files of the previous build
+    :type previous_files: dict
+    :param files: the files of this build
+    :type files: dict
+    :rtype: None
+    """
+    delta_path = dir_path / 'delta'
+    shutil.rmtree(str(delta_path), ignore_errors=True)
+    for name in IMAGE_PATHS:
+        os.makedirs(str(delta_path / name))
+
+    for path, state in files.items():
+        if (not path.startswith(TARGET_PATH + '/') and
+                previous_files.get(path) != state):
+            os.makedirs(str((delta_path / path).parent), exist_ok=True)
+            os.link(str(dir_path / path), str(delta_path / path))
+
+    removed = (
+        {_image_path(path) for path in previous_files} -
+        {_image_path(path) for path in files}
+    )
+    with (delta_path / 'removed.txt').open('w', encoding='utf-8') as f:
+        for path in sorted(removed):
+            f.write('{}\n'.format(path))
+
+
+def _image_path(path):
+    """Returns the path in the image of a file of the build directory
+
+    :param path: path of the file relative to the build directory
+    :type path: str
+    :rtype: str
+    """
+    if path.startswith(TARGET_PATH + '/'):
+        # `COPY universe/target/*` copies the contents of every directory in
+        # the target directory, not the directories themselves
+        relative_path = path[len(TARGET_PATH) + 1:].split('/', 1)[-1]
+        return '{}/{}'.format(IMAGE_PATHS['http'], relative_path)
+    name, relative_path = path.split('/', 1)
+    return '{}/{}'.format(IMAGE_PATHS[name], relative_path)
+
+
+def snapshot_files(dir_path, names):
+    """Returns the size and modification time of every file under the
+    directories `names` of `dir_path`, by path relative to `dir_path`
+
+    :param dir_path: path to the directory to build the image in
+    :type dir_path: pathlib.Path
+    :param names: names of the directories to list
+    :type names: [str]
+    :rtype: dict
+    """
+    files = {}
+    for name in names:
+        for root, _, filenames in os.walk(str(dir_path / name)):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                files[os.path.relpath(path, str(dir_path))] = [
+                    stat.st_size,
+                    stat.st_mtime_ns
+                ]
+    return files
+
+
+def print_manifest_changes(previous_manifest, manifest):
+    for name, key in (('packages', 'packages'),
+                      ('files', 'resources'),
+                      ('docker images', 'images')):
+        previous = {_manifest_key(item) for item in previous_manifest[key]}
+        current = {_manifest_key(item) for item in manifest[key]}
+        print('Since the previous build: {} {} added, {} removed'.format(
+            len(current - previous), name, len(previous - current)))
+
+
+def _manifest_key(item):
+    # Packages are stored as lists, which json has no tuples for
+    return tuple(item) if isinstance(item, list) else item
+
+
+def docker_image_exists(name):
+    command = ['docker', 'image', 'inspect', name]
+    return subprocess.call(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL) == 0
+
+
+@contextlib.contextmanager
+def working_directory(workdir):
+    """Yields `workdir`, created if needed, or a temporary directory that is
+    removed afterwards when `workdir` is None
+
+    :type workdir: str | None
+    :rtype: str
+    """
+    if workdir is None:
+        with tempfile.TemporaryDirectory() as dir_path:
+            yield dir_path
+        return
+
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    yield workdir
+
+
+def remove_stale_http_artifacts(http_artifacts, included_packages):
+    """Removes the http artifacts of every package version not included
 
+    :param http_artifacts: path to the root of the http artifacts, laid out
+                           as <package>/<version>/...
+    :type http_artifacts: pathlib.Path
+    :param included_packages: name and version of the included packages
+    :type included_packages: [(str, str)]
+    :rtype: None
+    """
+    included_packages = set(included_packages)
+    for package_path in http_artifacts.iterdir():
+        for version_path in package_path.iterdir():
+            if (package_path.name, version_path.name) not in included_packages:
+                shutil.rmtree(str(version_path))
+        if not any(package_path.iterdir()):
+            package_path.rmdir()
+
+
+class BuildReport:
+    """Collects the progress, timings and failures of a build. It is shared
+    by every thread of the build.
+
+    Downloads and images go through the same steps, by `kind`: `submit` when
+    they are queued, `start` when a worker picks them up and `finish` with
+    their timings when they are done.
+    """
+
+    KINDS = ('downloads', 'images')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._stage_start = self._start
+        self._stages = {}
+        self._total_packages = 0
+        self._finished_packages = 0
+        self._downloaded_bytes = 0
+        self._submitted = {kind: 0 for kind in self.KINDS}
+        self._started = {kind: 0 for kind in self.KINDS}
+        self._finished = {kind: [] for kind in self.KINDS}
+        self._failures = {'packages': [], 'resources': [], 'images': []}
+
+    def start_packages(self, total):
+        with self._lock:
+            self._total_packages = total
+
+    def finish_package(self):
+        with self._lock:
+            self._finished_packages += 1
+
+    def finish_stage(self, name):
+        """Records how long the stage `name`, which started when the previous
+        one finished, took
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._stages[name] = now - self._stage_start
+            self._stage_start = now
+
+    def submit(self, kind):
+        with self._lock:
+            self._submitted[kind] += 1
+
+    def start(self, kind):
+        with self._lock:
+            self._started[kind] += 1
+
+    def finish(self, kind, timings):
+        with self._lock:
+            self._finished[kind].append(timings)
+
+    def add_downloaded_bytes(self, count):
+        with self._lock:
+            self._downloaded_bytes += count
+
+    def add_failures(self, kind, names):
+        """Records failed `packages`, `resources` or `images`"""
+        with self._lock:
+            self._failures[kind].extend(names)
+
+    def failures(self, kind):
+        with self._lock:
+            return list(self._failures[kind])
+
+    def progress(self):
+        """Returns a one line summary of the progress of the build
+
+        :rtype: str
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._start
+            finished = self._finished_packages
+            total = self._total_packages
+            queues = {
+                kind: (
+                    self._started[kind] - len(self._finished[kind]),
+                    self._submitted[kind] - self._started[kind]
+                )
+                for kind in self.KINDS
+            }
+            downloaded_bytes = self._downloaded_bytes
+            failed = len(self._failures['packages'])
+
+        eta = 'unknown'
+        if 0 < finished < total:
+            eta = _format_seconds(elapsed / finished * (total - finished))
+        return (
+            'Progress: {}/{} packages ({} failed), '
+            'downloads {} running {} queued, {} at {}/s, '
+            'images {} running {} queued, elapsed {}, ETA {}'.format(
+                finished,
+                total,
+                failed,
+                queues['downloads'][0],
+                queues['downloads'][1],
+                _format_bytes(downloaded_bytes),
+                _format_bytes(downloaded_bytes / max(elapsed, 0.001)),
+                queues['images'][0],
+                queues['images'][1],
+                _format_seconds(elapsed),
+                eta
+            )
+        )
 
-def add_http_resource(dir_path, url, base_path):
-    archive_path = (dir_path / base_path /
-                    pathlib.Path(urllib.parse.urlparse(url).path).name)
-    print('Adding {} at {}.'.format(url, archive_path))
-    os.makedirs(str(archive_path.parent), exist_ok=True)
+    @contextlib.contextmanager
+    def print_progress(self, interval):
+        """Prints the progress every `interval` seconds while in the context
+
+        :param interval: seconds between reports; 0 prints nothing
+        :type interval: float
+        """
+        if interval <= 0:
+            yield
+            return
+
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.wait(interval):
+                print(self.progress())
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def to_json(self):
+        """Returns the timings and failures of the build
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'seconds': time.monotonic() - self._start,
+                'stages': dict(self._stages),
+                'packages': {
+                    'total': self._total_packages,
+                    'failed': len(self._failures['packages'])
+                },
+                'downloaded_bytes': self._downloaded_bytes,
+                'downloads': list(self._finished['downloads']),
+                'images': list(self._finished['images']),
+                'failures': {
+                    kind: list(names)
+                    for kind, names in self._failures.items()
+                }
+            }
+
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if count < 1024:
+            break
+        count /= 1024
+    return '{:.1f} {}'.format(count, unit)
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02}:{:02}'.format(hours, minutes, seconds)
+
+
+def add_http_resources(downloader, dir_path, resources):
+    """Downloads http resources concurrently and stores them under `dir_path`
+
+    :param downloader: the downloader to use
+    :type downloader: Downloader
+    :param dir_path: path to the root of the http artifacts
+    :type dir_path: pathlib.Path
+    :param resources: url, directory relative to `dir_path` and expected
+                      sha256, if known, of every resource
+    :type resources: [(str, pathlib.Path, str | None)]
+    :returns: the urls that could not be added
+    :rtype: [str]
+    """
+    downloads = [
+        (url, base_path, downloader.submit(url, sha256))
+        for url, base_path, sha256 in resources
+    ]
+
+    failed = []
+    for url, base_path, download in downloads:
+        archive_path = (dir_path / base_path /
+                        pathlib.Path(urllib.parse.urlparse(url).path).name)
+        print('Adding {} at {}.'.format(url, archive_path))
+        os.makedirs(str(archive_path.parent), exist_ok=True)
+        try:
+            downloader.store(download.result(), archive_path)
+        except Exception as e:
+            print("Error adding {}: {}.".format(url, e))
+            failed.append(url)
+    return failed
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Downloader:
+    """Downloads http resources into a content addressed cache. The cache
+    directory holds:
+
+        blobs/sha256/<digest>   the content of every completed download
+        urls/<key>.json         the digest of the content of each url
+        partial/<key>           an interrupted download of a url
+        partial/<key>.json      the validator of the partial download
+
+    where <key> is the sha256 of the url. A url found in the cache is not
+    downloaded again. Every file stored with `store` that has the same
+    content is a hardlink of the same blob, so it only takes space once, in
+    the http artifacts and in the docker image. When the cache is on another
+    file system, the blobs are copied once into `link_dir` and linked from
+    there. Concurrent requests for the same url share one download, and at
+    most `max_per_host` downloads run against any one host.
+    Failed downloads are retried with exponential backoff. Partial downloads
+    are resumed with a Range request when the server still has the same
+    content.
+    """
+
+    def __init__(
+            self,
+            cache_dir,
+            max_workers=5,
+            max_per_host=2,
+            retries=3,
+            backoff=1.0,
+            link_dir=None,
+            report=None):
+        self._cache_dir = cache_dir
+        self._link_dir = link_dir or cache_dir / 'links'
+        self._report = report or BuildReport()
+        for name in ('blobs/sha256', 'urls', 'partial'):
+            os.makedirs(str(cache_dir / name), exist_ok=True)
+        os.makedirs(str(self._link_dir), exist_ok=True)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._max_per_host = max_per_host
+        self._retries = retries
+        self._backoff = backoff
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._downloads = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown()
+
+    def submit(self, url, sha256=None):
+        """Starts downloading `url`, unless it is already cached or being
+        downloaded
+
+        :param url: the url to download
+        :type url: str
+        :param sha256: the expected sha256 of the content, if known
+        :type sha256: str | None
+        :returns: future of the path of the content in the cache
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            download = self._downloads.get(url)
+            if download is None:
+                download = self._executor.submit(self._fetch, url, sha256)
+                self._downloads[url] = download
+                self._report.submit('downloads')
+
+        if sha256 is None:
+            return download
+
+        # The url may have been requested before with a different checksum
+        verified = concurrent.futures.Future()
+
+        def verify(download):
+            try:
+                blob_path = download.result()
+            except Exception as e:
+                verified.set_exception(e)
+                return
+            if blob_path.name != sha256:
+                verified.set_exception(DownloadError(
+                    'Checksum mismatch for {}: expected sha256 {}, got {}'
+                    .format(url, sha256, blob_path.name)))
+            else:
+                verified.set_result(blob_path)
+
+        download.add_done_callback(verify)
+        return verified
+
+    def digests(self):
+        """Returns the sha256 of every url downloaded successfully
+
+        :rtype: dict
+        """
+        with self._lock:
+            downloads = list(self._downloads.items())
+        return {
+            url: download.result().name
+            for url, download in downloads
+            if download.done() and download.exception() is None
+        }
+
+    def store(self, blob_path, dest_path):
+        """Stores a downloaded blob at `dest_path` as a hardlink of the blob,
+        or of its copy in `link_dir` when the cache is on another file system
+
+        :param blob_path: path of the blob in the cache
+        :type blob_path: pathlib.Path
+        :param dest_path: path to store the blob at
+        :type dest_path: pathlib.Path
+        :rtype: None
+        """
+        with contextlib.suppress(FileNotFoundError):
+            dest_path.unlink()
+        try:
+            os.link(str(blob_path), str(dest_path))
+        except OSError:
+            link_path = self._link_dir / blob_path.name
+            if not _same_file(blob_path, link_path):
+                # Keep the modification time, which incremental builds
+                # compare. Concurrent copies of the same blob are identical,
+                # whichever replaces the other.
+                with tempfile.NamedTemporaryFile(
+                        dir=str(self._link_dir),
+                        delete=False) as link_file:
+                    pass
+                shutil.copy2(str(blob_path), link_file.name)
+                os.replace(link_file.name, str(link_path))
+            os.link(str(link_path), str(dest_path))
+
+        # The docker image serves the files as they are
+        os.chmod(str(dest_path), 0o644)
+
+    def remove_unused_links(self):
+        """Removes the copies in `link_dir` that no stored file links to"""
+        for link_path in self._link_dir.iterdir():
+            if link_path.stat().st_nlink == 1:
+                link_path.unlink()
+
+    def _fetch(self, url, sha256):
+        self._report.start('downloads')
+        timings = {'url': url, 'cached': False, 'attempts': 0, 'error': None}
+        start = time.monotonic()
+        try:
+            blob_path = self._fetch_blob(url, sha256, timings)
+            timings['bytes'] = blob_path.stat().st_size
+            if not timings['cached']:
+                timings['seconds'] = time.monotonic() - start
+                print('Downloaded {} ({} in {:.1f}s, {}/s).'.format(
+                    url,
+                    _format_bytes(timings['bytes']),
+                    timings['seconds'],
+                    _format_bytes(
+                        timings['bytes'] / max(timings['seconds'], 0.001))))
+            return blob_path
+        except Exception as e:
+            timings['error'] = str(e)
+            raise
+        finally:
+            self._report.finish('downloads', timings)
+
+    def _fetch_blob(self, url, sha256, timings):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        index_path = self._cache_dir / 'urls' / '{}.json'.format(key)
+        entry = _read_json_file(index_path)
+        if entry is not None:
+            blob_path = self._blob_path(entry['sha256'])
+            if blob_path.is_file() and sha256 in (None, entry['sha256']):
+                print('Using cached {}.'.format(url))
+                timings['cached'] = True
+                return blob_path
+
+        for attempt in range(self._retries + 1):
+            timings['attempts'] = attempt + 1
+            try:
+                with self._host_slot(url):
+                    partial_path, digest = self._download(url, key)
+                if sha256 is not None and digest != sha256:
+                    partial_path.unlink()
+                    raise DownloadError(
+                        'Checksum mismatch: expected sha256 {}, got {}'
+                        .format(sha256, digest))
+                break
+            except (DownloadError, OSError, http.client.HTTPException) as e:
+                if attempt == self._retries or not _is_retryable(e):
+                    raise
+                delay = self._backoff * 2 ** attempt
+                print('Retrying {} in {:.0f}s: {}'.format(url, delay, e))
+                time.sleep(delay)
+
+        blob_path = self._blob_path(digest)
+        if blob_path.is_file():
+            # Another url has the same content
+            partial_path.unlink()
+        else:
+            os.replace(str(partial_path), str(blob_path))
+        _write_json_file(index_path, {'url': url, 'sha256': digest})
+        with contextlib.suppress(FileNotFoundError):
+            (self._cache_dir / 'partial' / '{}.json'.format(key)).unlink()
+        return blob_path
+
+    def _download(self, url, key):
+        partial_path = self._cache_dir / 'partial' / key
+        meta_path = self._cache_dir / 'partial' / '{}.json'.format(key)
+
+        headers = {}
+        offset = 0
+        meta = _read_json_file(meta_path)
+        if (partial_path.is_file() and meta is not None and
+                meta['url'] == url and meta['validator']):
+            offset = partial_path.stat().st_size
+            if offset:
+                headers['Range'] = 'bytes={}-'.format(offset)
+                headers['If-Range'] = meta['validator']
+
+        print('Downloading {}{}.'.format(
+            url, ' from byte {}'.format(offset) if offset else ''))
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            response = urllib.request.urlopen(
+                request,
+                timeout=DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # The partial download is not a prefix of the content anymore
+                partial_path.unlink()
+                raise DownloadError('Cannot resume download: {}'.format(e))
+            raise
+
+        with response:
+            if (response.status != 206 or
+                    not response.headers.get('Content-Range', '').startswith(
+                        'bytes {}-'.format(offset))):
+                # The server sent the whole content
+                offset = 0
+
+            # If-Range only accepts strong validators
+            validator = response.headers.get('ETag')
+            if validator is None or validator.startswith('W/'):
+                validator = response.headers.get('Last-Modified')
+            _write_json_file(meta_path, {'url': url, 'validator': validator})
+
+            length = response.headers.get('Content-Length')
+            expected_size = offset + int(length) if length else None
+
+            digest = hashlib.sha256()
+            with partial_path.open('r+b' if offset else 'wb') as partial_file:
+                if offset:
+                    for chunk in iter(
+                            lambda: partial_file.read(DOWNLOAD_CHUNK_SIZE),
+                            b''):
+                        digest.update(chunk)
+                    partial_file.truncate(offset)
+                for chunk in iter(
+                        lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    partial_file.write(chunk)
+                    digest.update(chunk)
+                    self._report.add_downloaded_bytes(len(chunk))
+                size = partial_file.tell()
+
+        if expected_size is not None and size != expected_size:
+            raise DownloadError(
+                'Incomplete download: got {} of {} bytes'.format(
+                    size, expected_size))
+        return partial_path, digest.hexdigest()
+
+    @contextlib.contextmanager
+    def _host_slot(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self._max_per_host)
+                self._host_slots[host] = slot
+        with slot:
+            yield
+
+    def _blob_path(self, digest):
+        return self._cache_dir / 'blobs' / 'sha256' / digest
+
+
+def _same_file(blob_path, path):
+    """Returns whether `path` is a hardlink or a copy of `blob_path`"""
     try:
-        urllib.request.urlretrieve(url, str(archive_path))
-    except Exception as e:
-        print("Error adding {}: {}.".format(url, e))
+        blob_stat = blob_path.stat()
+        stat = path.stat()
+    except FileNotFoundError:
         return False
+    return os.path.samestat(blob_stat, stat) or (
+        blob_stat.st_size == stat.st_size and
+        blob_stat.st_mtime_ns == stat.st_mtime_ns)
+
+
+def _is_retryable(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in RETRYABLE_HTTP_CODES
     return True
 
+
+def _read_json_file(path):
+    try:
+        with path.open(encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_file(path, data):
+    # Write to a temporary file first so that an interrupted run never leaves
+    # a partially written file behind.
+    with tempfile.NamedTemporaryFile(
+            'w',
+            encoding='utf-8',
+            dir=str(path.parent),
+            delete=False) as json_file:
+        json.dump(data, json_file)
+    os.replace(json_file.name, str(path))
+
+
 def prepare_repository(
     package,
     version,
@@ -524,10 +1572,34 @@ def build_repository(scripts_dir, repo_dir, dest_dir):
     subprocess.check_call(command, cwd=str(dest_dir))
 
 
-def remove_package(package, base_dir):
-    for root, dirnames, filenames in os.walk(base_dir):
-        for dirname in fnmatch.filter(dirnames, package):
-            shutil.rmtree(os.path.join(root, dirname))
+def commit_staged_package(staging_path, repo_artifacts, http_artifacts):
+    """Moves the staged repository and http artifacts of a package into the
+    build, replacing the ones of a previous build
+
+    :param staging_path: path to the staging directory of the package, with
+                         the repository files in repo/<letter>/<package>/<rev>
+                         and the http artifacts in http/<package>/<version>
+    :type staging_path: pathlib.Path
+    :param repo_artifacts: path to the root of the repository packages
+    :type repo_artifacts: pathlib.Path
+    :param http_artifacts: path to the root of the http artifacts
+    :type http_artifacts: pathlib.Path
+    :rtype: None
+    """
+    replaced_path = staging_path / 'replaced'
+    for staged_root, pattern, target_root in (
+            (staging_path / 'http', '*/*', http_artifacts),
+            (staging_path / 'repo', '*/*/*', repo_artifacts)):
+        for staged_path in staged_root.glob(pattern):
+            target_path = target_root / staged_path.relative_to(staged_root)
+            os.makedirs(str(target_path.parent), exist_ok=True)
+            if target_path.exists():
+                os.makedirs(str(replaced_path), exist_ok=True)
+                os.rename(
+                    str(target_path),
+                    str(pathlib.Path(tempfile.mkdtemp(dir=str(replaced_path)),
+                                     target_path.name)))
+            os.rename(str(staged_path), str(target_path))
 
 
 if __name__ == '__main__':
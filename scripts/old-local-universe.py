@@ -3,11 +3,12 @@
 import argparse
 import concurrent.futures
 import contextlib
-import distutils.version
 import fnmatch
+import functools
 import json
 import os
 import pathlib
+import re
 import shutil
 import subprocess
 import sys
@@ -19,6 +20,8 @@ import urllib.request
 
 HTTP_ROOT = "http://master.mesos:8082/"
 DOCKER_ROOT = "master.mesos:5000"
+# Components of a version string, as split by distutils' LooseVersion
+VERSION_COMPONENT_RE = re.compile(r'(\d+ | [a-z]+ | \.)', re.VERBOSE)
 
 
 def main():
@@ -75,7 +78,7 @@ def main():
 
     package_names = [name for name in args.include.split(',') if name != '']
 
-    dcos_version = distutils.version.LooseVersion(args.dcos_version)
+    dcos_version = parse_version(args.dcos_version)
 
     with tempfile.TemporaryDirectory() as dir_path, \
             run_docker_registry(dir_path / pathlib.Path("registry")):
@@ -168,7 +171,7 @@ def enumerate_dcos_packages(
     :type only_selected: boolean
     :param: dcos_version: filter the list of packages to only ones compatible
                           with this DC/OS version; if None, do not filter
-    :type dcos_version: distutils.version.LooseVersion | None
+    :type dcos_version: tuple | None
     :returns: generator of package name and revision
     :rtype: gen((str, pathlib.Path))
     """
@@ -176,7 +179,7 @@ def enumerate_dcos_packages(
         if dcos_version:
             raw_version = package_json.get('minDcosReleaseVersion')
             if raw_version:
-                min_version = distutils.version.LooseVersion(raw_version)
+                min_version = parse_version(raw_version)
                 if dcos_version < min_version:
                     return False
         return True
@@ -213,6 +216,22 @@ def enumerate_dcos_packages(
                     break
 
 
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    """Parses a DC/OS release version into a tuple that compares like
+    distutils' LooseVersion
+
+    :param version: version string, e.g. "1.10"
+    :type version: str
+    :rtype: tuple
+    """
+    return tuple(
+        int(component) if component.isdecimal() else component
+        for component in VERSION_COMPONENT_RE.split(version)
+        if component and component != '.'
+    )
+
+
 def enumerate_http_resources(package, package_path, skip_images, skip_cli):
     resource_path = package_path / 'resource.json'
     with resource_path.open(encoding='utf-8') as json_file:
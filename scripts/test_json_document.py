@@ -0,0 +1,45 @@
+import pathlib
+import tempfile
+import unittest
+
+from json_document import load_json_document
+
+
+class LoadJsonDocumentTest(unittest.TestCase):
+
+    def load(self, content):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / 'package.json'
+            path.write_bytes(content)
+            return load_json_document(path)
+
+    def test_control_character_is_an_escaped_unicode_literal(self):
+        document = self.load(b'{"description": "a\\u0001b"}')
+        self.assertEqual(document.escaped_unicode_literals, ['\\u0001'])
+        self.assertTrue(document.is_ascii)
+
+    def test_control_character_in_list_and_key(self):
+        document = self.load(b'{"tags": ["\\u001f"], "k\\u0002": 1}')
+        self.assertEqual(
+            sorted(document.escaped_unicode_literals),
+            ['\\u0002', '\\u001f'])
+
+    def test_short_escapes_are_allowed(self):
+        document = self.load(b'{"description": "a\\nb\\tc\\"d\\\\e"}')
+        self.assertEqual(document.escaped_unicode_literals, [])
+
+    def test_non_ascii_and_escaped_literal(self):
+        document = self.load(
+            '{"a": "é", "b": "\\\\u0041"}'.encode('utf-8'))
+        self.assertFalse(document.is_ascii)
+        self.assertEqual(
+            document.escaped_unicode_literals, ['\\u00e9', '\\u0041'])
+
+    def test_duplicate_keys(self):
+        document = self.load(b'{"a": {"b": 1, "b": 2}, "a": 3}')
+        self.assertEqual(document.duplicate_keys, ['b', 'a'])
+        self.assertEqual(document.data, {'a': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
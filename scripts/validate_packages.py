@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
 import json
 import jsonschema
 import os
+import pathlib
 import re
 import pystache
 import sys
-from distutils.version import LooseVersion
+import tempfile
+from gen_universe import changed_packages, parse_version
+from json_document import load_json_document
 from pystache.parser import ParsingError
 
 
@@ -16,60 +23,265 @@ PKG_DIR = os.path.join(UNIVERSE_DIR, "repo/packages")
 SCHEMA_DIR = os.path.join(UNIVERSE_DIR, "repo/meta/schema")
 LETTER_PATTERN = re.compile("^[A-Z]$")
 PACKAGE_FOLDER_PATTERN = re.compile("^[a-z][a-z0-9-]*[a-z0-9]$")
-ESCAPED_UNICODE_LITERAL = re.compile("\\\[u][a-fA-F0-9]{4}")
+# Bump to invalidate the template check results kept in --cache-dir
+TEMPLATE_CACHE_VERSION = 1
 
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
-def _get_json_schema(file_name):
+def _get_json_validator(file_name):
     with open(os.path.join(SCHEMA_DIR, file_name), encoding='utf-8') as f:
-        return json.loads(f.read())
+        return jsonschema.Draft4Validator(json.loads(f.read()))
 
-PACKAGE_JSON_SCHEMA = _get_json_schema('package-schema.json')
-COMMAND_JSON_SCHEMA = _get_json_schema('command-schema.json')
-CONFIG_JSON_SCHEMA = _get_json_schema('config-schema.json')
-V2_RESOURCE_JSON_SCHEMA = _get_json_schema('v2-resource-schema.json')
-V3_RESOURCE_JSON_SCHEMA = _get_json_schema('v3-resource-schema.json')
+# The schemas only reference their own definitions, so one validator per
+# schema is shared by every file.
+PACKAGE_JSON_VALIDATOR = _get_json_validator('package-schema.json')
+COMMAND_JSON_VALIDATOR = _get_json_validator('command-schema.json')
+CONFIG_JSON_VALIDATOR = _get_json_validator('config-schema.json')
+V2_RESOURCE_JSON_VALIDATOR = _get_json_validator('v2-resource-schema.json')
+V3_RESOURCE_JSON_VALIDATOR = _get_json_validator('v3-resource-schema.json')
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='This script validates every package revision in the '
+        'universe repository and reports all of the problems found.')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of worker processes used to validate revisions. '
+        'Defaults to 1 (no worker processes)')
+    parser.add_argument(
+        '--json-report',
+        dest='json_report',
+        help='Path to a file to write the problems found to, as json')
+    parser.add_argument(
+        '--changed-since',
+        dest='changed_since',
+        help='Git revision, e.g. HEAD. Only the packages changed since then, '
+        'including uncommitted changes, are validated. Every revision of a '
+        'changed package is validated')
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        type=pathlib.Path,
+        help='Path to a directory used to keep the results of the template '
+        'checks between runs. Templates whose content did not change are '
+        'not checked again')
+    parser.add_argument(
+        '--render-templates',
+        dest='render_templates',
+        action='store_true',
+        help='Also render every marathon.json.mustache with the defaults from '
+        'its config.json and check that the result is valid json. Problems '
+        'are reported as warnings')
+    args = parser.parse_args()
+
+    if args.cache_dir is not None:
+        args.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    selected_packages = None
+    if args.changed_since is not None:
+        selected_packages = changed_packages(
+            pathlib.Path(PKG_DIR),
+            args.changed_since
+        )
+    errors, revisions = _enumerate_revisions(PKG_DIR, selected_packages)
+    warnings = []
+    for given_package, revision, (revision_errors, revision_warnings) in \
+            validate_revisions(
+                revisions,
+                args.jobs,
+                args.cache_dir,
+                args.render_templates):
+        eprint("Validating {} revision {}...\t{}".format(
+            given_package,
+            revision,
+            "ERROR" if revision_errors else "OK"
+        ))
+        errors.extend(
+            _error(given_package, revision, file_name, message)
+            for file_name, message in revision_errors
+        )
+        warnings.extend(
+            _error(given_package, revision, file_name, message)
+            for file_name, message in revision_warnings
+        )
+
+    if args.json_report:
+        with open(args.json_report, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'revisions': len(revisions),
+                    'errors': errors,
+                    'warnings': warnings
+                },
+                f,
+                indent=2
+            )
+
+    if warnings:
+        eprint("\n{} warning(s):\n".format(len(warnings)))
+        for warning in warnings:
+            eprint(_format_error(warning))
+
+    if errors:
+        eprint("\n\tERROR\n\n{} problem(s) found:\n".format(len(errors)))
+        for error in errors:
+            eprint(_format_error(error))
+        return 1
+
+    eprint("\nEverything OK!")
+
+
+def _enumerate_revisions(packages_dir, selected_packages=None):
+    """Lists the revisions of every package in `packages_dir`
+
+    :param packages_dir: path to the root of the packages
+    :type packages_dir: str
+    :param selected_packages: only list the revisions of these packages, if
+                              given
+    :type selected_packages: {str} | None
+    :return the errors in the layout of the directory, and a
+            (package directory name, revision, path) tuple per revision
+    :rtype ([dict], [(str, str, str)])
+    """
+    errors, revisions = [], []
     # traverse prefix dirs ("A", "B", etc)
-    for letter in sorted(os.listdir(PKG_DIR)):
+    for letter in sorted(os.listdir(packages_dir)):
         if not LETTER_PATTERN.match(letter):
-            sys.exit(
-                "\tERROR\n\n"
+            errors.append(_error(
+                None,
+                None,
+                letter,
                 "Invalid name for directory : {}\nName should match the "
                 "pattern : {}".format(letter, LETTER_PATTERN.pattern)
-            )
-        prefix_path = os.path.join(PKG_DIR, letter)
+            ))
+            continue
+        prefix_path = os.path.join(packages_dir, letter)
         # traverse each package dir directory (e.g., "cassandra")
         for given_package in sorted(os.listdir(prefix_path)):
+            if (selected_packages is not None and
+                    given_package not in selected_packages):
+                continue
             package_path = os.path.join(prefix_path, given_package)
-            _validate_package(given_package, package_path)
-
-    eprint("\nEverything OK!")
-
+            for rev in sorted(os.listdir(package_path), key=int):
+                revisions.append(
+                    (given_package, rev, os.path.join(package_path, rev))
+                )
+    return errors, revisions
+
+
+def validate_revisions(
+        revisions,
+        jobs=1,
+        cache_dir=None,
+        render_templates=False):
+    """Validates package revisions. Results are yielded in the order of
+    `revisions` regardless of `jobs`.
+
+    :param revisions: (package directory name, revision, path) tuples
+    :type revisions: [(str, str, str)]
+    :param jobs: number of worker processes to use; 1 validates in this
+                 process
+    :type jobs: int
+    :param cache_dir: directory of previous template check results, if any
+    :type cache_dir: pathlib.Path | None
+    :param render_templates: whether to render the templates with the
+                             defaults of their config.json
+    :type render_templates: bool
+    :return (package directory name, revision, (errors, warnings)) for every
+            revision, see `_validate_revision`
+    :rtype gen((str, str, ([(str, str)], [(str, str)])))
+    """
+    if not revisions:
+        return
+    given_packages, revision_names, paths = zip(*revisions)
+    if jobs <= 1:
+        results = map(
+            _validate_revision,
+            given_packages,
+            revision_names,
+            paths,
+            itertools.repeat(cache_dir),
+            itertools.repeat(render_templates)
+        )
+        yield from zip(given_packages, revision_names, results)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            _validate_revision,
+            given_packages,
+            revision_names,
+            paths,
+            itertools.repeat(cache_dir),
+            itertools.repeat(render_templates),
+            chunksize=max(1, len(revisions) // (jobs * 4))
+        )
+        yield from zip(given_packages, revision_names, results)
 
-def _validate_package(given_package, path):
-    eprint("Validating {}...".format(given_package))
-    for rev in sorted(os.listdir(path), key=int):
-        _validate_revision(given_package, rev, os.path.join(path, rev))
 
+def _validate_revision(
+        given_package,
+        revision,
+        path,
+        cache_dir=None,
+        render_templates=False):
+    """Validates every file of a package revision
 
-def _validate_revision(given_package, revision, path):
-    eprint("\tValidating revision {}...".format(revision))
+    :return the errors and the warnings found, as (file name, message)
+            tuples
+    :rtype ([(str, str)], [(str, str)])
+    """
+    errors, warnings = [], []
 
     # validate package.json
     package_json_path = os.path.join(path, 'package.json')
-    eprint("\t\tpackage.json:", end='')
+    package_json = None
     if not os.path.isfile(package_json_path):
-        sys.exit("\tERROR\n\nMissing required package.json file")
-    package_json = _validate_json(package_json_path, PACKAGE_JSON_SCHEMA)
-    package_name = package_json.get("name")
-    _validate_package_with_directory(given_package, package_name)
-    eprint("\tOK")
+        errors.append(('package.json', "Missing required package.json file"))
+    else:
+        try:
+            package_json = _validate_json(
+                package_json_path,
+                PACKAGE_JSON_VALIDATOR,
+                warnings
+            )
+            _validate_package_with_directory(
+                given_package,
+                package_json.get("name")
+            )
+        except ValueError as e:
+            errors.append(('package.json', str(e)))
+
+    # validate config.json
+    config_json_path = os.path.join(path, 'config.json')
+    if os.path.isfile(config_json_path):
+        try:
+            _validate_json(config_json_path, CONFIG_JSON_VALIDATOR, warnings)
+        except ValueError as e:
+            errors.append(('config.json', str(e)))
+
+    # validate (optional) marathon.json.mustache
+    marathon_json_path = os.path.join(path, 'marathon.json.mustache')
+    if os.path.isfile(marathon_json_path):
+        try:
+            _validate_mustache_template(
+                path,
+                cache_dir,
+                render_templates,
+                warnings
+            )
+        except ValueError as e:
+            errors.append(('marathon.json.mustache', str(e)))
+
+    if package_json is None:
+        # The remaining files are validated depending on package.json
+        return errors, warnings
 
     packaging_version = package_json.get("packagingVersion", "2.0")
 
@@ -79,7 +291,7 @@ def _validate_revision(given_package, revision, path):
     downgrades_to = package_json.get("downgradesTo", None)
     if (packaging_version == "4.0" and
             (upgrades_from or downgrades_to) and
-            LooseVersion(min_dcos_release_version) < LooseVersion("1.10")):
+            parse_version(min_dcos_release_version) < parse_version("1.10")):
         # Note: We are going to allow this package state and as a result the
         # conversion from v4 to v3. Even though this conversion loses
         # information, the only consumers of the Universe repo API is "Cosmos
@@ -96,104 +308,249 @@ def _validate_revision(given_package, revision, path):
     command_json_path = os.path.join(path, 'command.json')
     command_json = None
     if os.path.isfile(command_json_path):
-        eprint("\t\tcommand.json:", end='')
-        if packaging_version >= LooseVersion("4.0"):
-            sys.exit(
-                "\tERROR\n\n"
-                "Command file is not support for version 4.0 and above packages"
-            )
+        if parse_version(packaging_version) >= parse_version("4.0"):
+            errors.append((
+                'command.json',
+                "Command file is not support for version 4.0 and above "
+                "packages"
+            ))
         else:
-            command_json = _validate_json(
-                command_json_path,
-                COMMAND_JSON_SCHEMA
-            )
-        eprint("\tOK")
-
-    # validate config.json
-    config_json_path = os.path.join(path, 'config.json')
-    if os.path.isfile(config_json_path):
-        eprint("\t\tconfig.json:", end='')
-        _validate_json(config_json_path, CONFIG_JSON_SCHEMA)
-        eprint("\tOK")
-
-    # validate (optional) marathon.json.mustache
-    marathon_json_path = os.path.join(path, 'marathon.json.mustache')
-    if os.path.isfile(marathon_json_path):
-        eprint("\t\tmarathon.json.mustache:", end='')
-        _validate_mustache_template(marathon_json_path)
-        eprint("\tOK")
+            try:
+                command_json = _validate_json(
+                    command_json_path,
+                    COMMAND_JSON_VALIDATOR,
+                    warnings
+                )
+            except ValueError as e:
+                errors.append(('command.json', str(e)))
 
     # validate resource.json
     resource_json_path = os.path.join(path, 'resource.json')
     resource_json = None
     if os.path.isfile(resource_json_path):
-        eprint("\t\tresource.json:", end='')
-        if packaging_version == "2.0":
-            resource_json = _validate_json(
-                resource_json_path,
-                V2_RESOURCE_JSON_SCHEMA)
-        else:
+        try:
             resource_json = _validate_json(
                 resource_json_path,
-                V3_RESOURCE_JSON_SCHEMA)
-        eprint("\tOK")
+                V2_RESOURCE_JSON_VALIDATOR if packaging_version == "2.0"
+                else V3_RESOURCE_JSON_VALIDATOR,
+                warnings
+            )
+        except ValueError as e:
+            errors.append(('resource.json', str(e)))
 
     # Validate that we don't drop information during the conversion
-    old_package = LooseVersion(
-        package_json.get('minDcosReleaseVersion', "1.0")) < LooseVersion("1.8")
+    old_package = parse_version(
+        package_json.get('minDcosReleaseVersion', "1.0")) < parse_version("1.8")
     if (old_package and resource_json and 'cli' in resource_json and
             command_json is None):
-        sys.exit('\tERROR\n\nA package with CLI specified in resource.json is '
-                 'only supported when minDcosReleaseVersion is greater than '
-                 '1.8.')
+        errors.append((
+            'resource.json',
+            'A package with CLI specified in resource.json is only supported '
+            'when minDcosReleaseVersion is greater than 1.8.'
+        ))
+
+    return errors, warnings
 
 
 def _validate_package_with_directory(given_package, actual_package_name):
     if not PACKAGE_FOLDER_PATTERN.match(given_package):
-        sys.exit(
-            "\tERROR\n\n"
+        raise ValueError(
             "Invalid name for package directory : {}"
             "\nName should match the pattern : {}"
             .format(given_package, PACKAGE_FOLDER_PATTERN.pattern)
         )
     if given_package != actual_package_name:
-        sys.exit(
-            "\tERROR\n\n"
+        raise ValueError(
             "The name parameter in package.json should match with the name of "
             "the package directory.\nDirectory : {}, Parsed Name : {}"
             .format(given_package, actual_package_name)
         )
 
 
-def _validate_json(path, schema):
+def _validate_json(path, validator, warnings):
+    document = load_json_document(pathlib.Path(path))
     # Charset needs to be `ascii` because cosmos 0.6.2 and below uses default
     # encoding (specified by system property `file.encoding` - ascii on coreos)
-    with open(path, encoding='ascii') as f:
-        data = json.loads(f.read())
-        # DCOS-42473 : Package should NOT contain escaped unicode literals
-        json_content = json.dumps(data)
-        result = ESCAPED_UNICODE_LITERAL.findall(json_content)
-        assert not result, "Invalid literal(s) [{}] in [{}]"\
-            .format(result, json_content)
-
-    _validate_jsonschema(data, schema)
-    return data
-
-
-def _validate_jsonschema(instance, schema):
-    validator = jsonschema.Draft4Validator(schema)
+    if not document.is_ascii:
+        raise ValueError("File contains non-ASCII characters")
+    # DCOS-42473 : Package should NOT contain escaped unicode literals
+    if document.escaped_unicode_literals:
+        raise ValueError("Invalid literal(s) [{}] in [{}]"
+                         .format(document.escaped_unicode_literals, path))
+    if document.duplicate_keys:
+        warnings.append((
+            os.path.basename(path),
+            "Duplicate key(s) {}, only the last value of each is used".format(
+                document.duplicate_keys)
+        ))
+
+    _validate_jsonschema(document.data, validator)
+    return document.data
+
+
+def _validate_jsonschema(instance, validator):
     errors = list(validator.iter_errors(instance))
     if len(errors) != 0:
-        sys.exit("\tERROR\n\nValidation error: {}".format(errors))
-
-
-def _validate_mustache_template(mustache_path):
-    with open(mustache_path, encoding='utf-8') as f:
-        mustache_template = f.read()
-        try:
-            pystache.parse(mustache_template)
-        except ParsingError as pe:
-            sys.exit("\tERROR\n\nParsing error: {}".format(str(pe)))
+        raise ValueError("Validation error: {}".format(
+            "\n".join(
+                "{}: {}".format(
+                    "/".join(str(p) for p in error.absolute_path) or "<root>",
+                    error.message
+                )
+                for error in errors
+            )
+        ))
+
+
+def _validate_mustache_template(path, cache_dir, render_templates, warnings):
+    template = _read_bytes(os.path.join(path, 'marathon.json.mustache'))
+    error = _cached_check(cache_dir, _parse_template, template)
+    if error is not None:
+        raise ValueError(error)
+
+    if render_templates:
+        error = _cached_check(
+            cache_dir,
+            _render_template,
+            template,
+            _read_bytes(os.path.join(path, 'config.json')),
+            _read_bytes(os.path.join(path, 'resource.json'))
+        )
+        if error is not None:
+            warnings.append(('marathon.json.mustache', error))
+
+
+def _read_bytes(path):
+    if not os.path.isfile(path):
+        return b''
+    with open(path, mode='rb') as f:
+        return f.read()
+
+
+# Template check results of this process, by content digest. Revisions of a
+# package often share byte-identical templates.
+_template_check_results = {}
+
+
+def _cached_check(cache_dir, check, *contents):
+    """Runs `check` on `contents` unless a result for the same check and
+    contents is known, either from this process or from `cache_dir`
+
+    :param cache_dir: directory of previous check results, if any
+    :type cache_dir: pathlib.Path | None
+    :param check: function of `contents` that returns an error message or None
+    :type check: function
+    :param contents: file contents to check
+    :type contents: [bytes]
+    :return the error message, if any
+    :rtype str | None
+    """
+    digest = hashlib.sha256()
+    digest.update('{}\0{}\0'.format(
+        TEMPLATE_CACHE_VERSION, check.__name__).encode())
+    for content in contents:
+        digest.update('{}\0'.format(len(content)).encode())
+        digest.update(content)
+    key = digest.hexdigest()
+
+    if key in _template_check_results:
+        return _template_check_results[key]
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = cache_dir / '{}.json'.format(key)
+        if cache_path.is_file():
+            with cache_path.open(encoding='utf-8') as cache_file:
+                error = json.load(cache_file)['error']
+            _template_check_results[key] = error
+            return error
+
+    error = check(*contents)
+    _template_check_results[key] = error
+
+    if cache_path is not None:
+        # Write to a temporary file first so that concurrent runs sharing the
+        # cache never observe a partially written entry.
+        with tempfile.NamedTemporaryFile(
+                'w',
+                encoding='utf-8',
+                dir=str(cache_dir),
+                delete=False) as cache_file:
+            json.dump({'error': error}, cache_file)
+        os.replace(cache_file.name, str(cache_path))
+
+    return error
+
+
+def _parse_template(template):
+    try:
+        pystache.parse(template.decode('utf-8'))
+    except (ParsingError, UnicodeDecodeError) as e:
+        return "Parsing error: {}".format(str(e))
+    return None
+
+
+class _JsonRenderer(pystache.Renderer):
+    """Renders non-string values the way Cosmos does, as json"""
+
+    def str_coerce(self, val):
+        return json.dumps(val)
+
+
+def _render_template(template, config, resource):
+    """Renders a template the way Cosmos does when a package is installed
+    without options: the context holds the config.json defaults and the
+    resource.json under `resource`, with the strings json escaped.
+    """
+    try:
+        context = _json_escape(_config_defaults(json.loads(config or '{}')))
+        context['resource'] = _json_escape(json.loads(resource or '{}'))
+        rendered = _JsonRenderer().render(template.decode('utf-8'), context)
+        json.loads(rendered)
+    except ValueError as e:
+        return ("Rendering with the config.json defaults does not produce "
+                "valid json: {}".format(str(e)))
+    return None
+
+
+def _config_defaults(schema):
+    defaults = {}
+    for name, value in schema.get('properties', {}).items():
+        if 'default' in value:
+            defaults[name] = value['default']
+        elif value.get('type') == 'object' and 'properties' in value:
+            defaults[name] = _config_defaults(value)
+    return defaults
+
+
+def _json_escape(value):
+    if isinstance(value, str):
+        return json.dumps(value)[1:-1]
+    if isinstance(value, list):
+        return [_json_escape(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _json_escape(item) for key, item in value.items()}
+    return value
+
+
+def _error(given_package, revision, file_name, message):
+    return {
+        'package': given_package,
+        'revision': revision,
+        'file': file_name,
+        'message': message
+    }
+
+
+def _format_error(error):
+    location = '/'.join(
+        part for part in (error['package'], error['revision'], error['file'])
+        if part is not None
+    )
+    return "{}:\n\t{}".format(
+        location,
+        error['message'].replace("\n", "\n\t")
+    )
 
 
 if __name__ == '__main__':